@@ -1,182 +1,287 @@
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import dcc, html, Patch, no_update
+from dash.dependencies import Input, Output, State
 from zipfile import BadZipFile
-import pandas as pd
-import requests
-import urllib3
 import logging
 import time
 import datetime
-from openpyxl import load_workbook
+import threading
+import socket
+import hashlib
+import tempfile
+import atexit
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import os
 import json
-import win32com.client
 
-# Suprimir la advertencia InsecureRequestWarning
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Configuración de logging
-logging.basicConfig(
-    filename='logfile.log',  # Nombre del archivo de registro
-    level=logging.DEBUG,  # Nivel de registro
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Formato de los mensajes de registro
+from snapshot_store import ARCHIVO_SNAPSHOT, guardar_snapshot, cargar_snapshot, cargar_csv_legado, guardar_pickle_atomico, cargar_pickle
+from estado_compartido import ARCHIVO_ESTADO, EstadoCompartido
+from horometro_history import HistorialHorometros
+from metrics import registro as metricas, medir, incrementar, formato_prometheus_combinado
+from logging_setup import configurar_logging, Resumen
+from resilience import obtener_breaker, llamar_con_reintentos, Plazo, CircuitoAbierto, PlazoAgotado
+
+# pandas, requests y openpyxl se importan recién cuando se usan (dentro de las funciones),
+# para que el servidor arranque sin esperar a cargarlos
+
+# Configuración de logging: los registros se encolan y un hilo aparte los escribe en
+# logfile.log, que rota al superar LOG_MAX_BYTES (por defecto 10 MB)
+configurar_logging(
+    archivo='logfile.log',  # Nombre del archivo de registro
+    nivel=os.environ.get('LOG_LEVEL', 'DEBUG'),  # Nivel de registro
+    max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    respaldos=int(os.environ.get('LOG_RESPALDOS', 5)),
 )
 
+# Catálogo de equipos: mapeos de serialNumber, ajustes, columnas de Excel, imágenes,
+# categorías y orden (editable desde catalogo_equipos.json)
+ARCHIVO_CATALOGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogo_equipos.json')
+
+with open(ARCHIVO_CATALOGO, encoding='utf-8') as archivo_catalogo:
+    config_catalogo = json.load(archivo_catalogo)
+
 # Mapeo de serialNumber a alias
-serial_to_alias = {
-    'H11601054': 'RS31',
-    'H11601215': 'RS47',
-    'H11601217': 'RS48',
-    'H11601240': 'RS49',
-    'H11601241': 'RS50',
-    'H11601269': 'RS51',
-    'H11601270': 'RS52',
-    'H11601280': 'RS53'
-}
+serial_to_alias = config_catalogo['serial_to_alias']
+
+# Ajustes de horómetro por alias
+ajustes = config_catalogo['ajustes']
 
 # Mapeo de alias a columnas en el archivo Excel
-alias_column_map = {
-    'FL 99': 'B', 'FL 102': 'C', 'FL 103': 'D', 'FL 104': 'E',
-    'FL 105': 'F', 'FL 106': 'G', 'FL 107': 'H', 'FL 108': 'I',
-    'FL 500': 'J', 'FL 501': 'K', 'FL160': 'L'
-}
-
-# Mapeo de alias a imágenes
-imagen_por_alias = {
-    'FL16': 'FL16T SIN FONDO',
-    'FL': 'Forklift',
-    'RS': 'Reachstaker sin fondo',
-    'RTG': 'RTG SIN FONDO',
-    'GR': 'MHC SIN FONDO'
-}
-
-last_api_call = 0  # Variable para almacenar el timestamp de la última llamada exitosa a la API
-api_wait_time = 0  # Variable para almacenar el tiempo de espera sugerido por la API
+alias_column_map = config_catalogo['alias_column_map']
+
+# Mapeo de prefijo de alias a imágenes (se evalúa en orden: 'FL16' antes que 'FL')
+imagen_por_alias = dict(config_catalogo['imagenes'])
+
+# Categorías: prefijo -> (título, rango de orden)
+categorias = {prefijo: (titulo, rango) for prefijo, titulo, rango in config_catalogo['categorias']}
+
 last_update_time = "No disponible"  # Inicializar la variable global
 
-def safe_json_loads(json_str):
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:
-        logging.error(f"Error al decodificar JSON: {e}")
-        return {}
-    except Exception as e:
-        logging.error(f"Error desconocido: {e}")
-        return {}
-    
+# Modo producción (varios workers de gunicorn): el estado de rate-limit, el liderazgo del
+# refresco y la versión del snapshot se comparten entre procesos en un archivo SQLite
+MODO_PRODUCCION = os.environ.get('MODO_PRODUCCION', '0') == '1'
+estado_compartido = EstadoCompartido(os.environ.get('ESTADO_COMPARTIDO', ARCHIVO_ESTADO)) if MODO_PRODUCCION else None
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class ClienteAPI:
+    """
+    Cliente HTTP con sesión y conexiones reutilizables que recuerda el tiempo de
+    espera pedido por la API (last_api_call / api_wait_time) y no la llama antes de tiempo.
+    Con un estado compartido, ese tiempo de espera lo ven todos los workers.
+    Las llamadas pasan por un circuit breaker propio del endpoint: con el circuito abierto
+    get() lanza CircuitoAbierto de inmediato en lugar de esperar el timeout.
+    """
+
+    def __init__(self, nombre, timeout, max_conexiones=2, estado=None, etapa='api', reintentos=1):
+        self.nombre = nombre
+        self.etapa = etapa
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.breaker = obtener_breaker(
+            etapa,
+            umbral_fallas=int(os.environ.get('CIRCUITO_UMBRAL_FALLAS', 3)),
+            tiempo_apertura=int(os.environ.get('CIRCUITO_APERTURA', 600)),
+        )
+        self.estado = estado
+        self.max_conexiones = max_conexiones
+        self._session = None
+        self._espera = (0, 0)  # (timestamp de la última llamada, tiempo de espera sugerido por la API)
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # La sesión (y requests) se crea en la primera llamada a la API
+        with self._lock:
+            if self._session is None:
+                import requests
+                import urllib3
+                from requests.adapters import HTTPAdapter
+
+                # Suprimir la advertencia InsecureRequestWarning
+                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+                session = requests.Session()
+                session.verify = False
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_conexiones)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def _leer_espera(self):
+        if self.estado is not None:
+            return tuple(self.estado.leer(f'rate_limit:{self.nombre}', (0, 0)))
+        return self._espera
+
+    @property
+    def last_api_call(self):
+        return self._leer_espera()[0]
+
+    @property
+    def api_wait_time(self):
+        return self._leer_espera()[1]
+
+    def en_espera(self):
+        last_api_call, api_wait_time = self._leer_espera()
+        return time.time() < last_api_call + api_wait_time
+
+    def registrar_espera(self, segundos):
+        if segundos:
+            incrementar(f'{self.etapa}_rate_limit')
+        with self._lock:
+            self._espera = (time.time(), segundos)
+            if self.estado is not None:
+                self.estado.escribir(f'rate_limit:{self.nombre}', self._espera)
+
+    def registrar_exito(self):
+        # Resetear el tiempo de espera si la llamada fue exitosa
+        self.registrar_espera(0)
+
+    def get(self, url, plazo=None, **kwargs):
+        import requests
+
+        timeout = kwargs.pop('timeout', self.timeout)
+
+        def solicitar(timeout_intento):
+            response = self.session.get(url, timeout=timeout_intento, **kwargs)
+            # Los errores del servidor cuentan como falla del endpoint (y se reintentan)
+            if response.status_code >= 500:
+                response.raise_for_status()
+            return response
+
+        with medir(self.etapa):
+            response = llamar_con_reintentos(
+                solicitar, self.breaker, plazo=plazo, timeout=timeout,
+                reintentos=self.reintentos, errores=(requests.exceptions.RequestException,),
+            )
+        # Respeta Retry-After si la API responde 429
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After', '60')
+            self.registrar_espera(int(retry_after) if retry_after.isdigit() else 60)
+        return response
+
+# Clientes compartidos (timeout = (conexión, lectura) en segundos)
+cliente_cae = ClienteAPI('CAE NTR', timeout=(5, 10), estado=estado_compartido, etapa='api_cae')
+cliente_kalmar = ClienteAPI('Kalmar runningHours', timeout=(5, 20), estado=estado_compartido, etapa='api_kalmar')
+
+# Ambas APIs se consultan en paralelo; el plazo total acota la espera del refresco
+executor_apis = ThreadPoolExecutor(max_workers=2, thread_name_prefix='apis')
+PLAZO_APIS = 30
+
 # Función personalizada para ordenar los alias
 def ordenar_alias(alias):
     if isinstance(alias, str):  # Verificar que el alias sea una cadena de texto
-        if alias.startswith('GR'):
-            return (1, alias)
-        elif alias.startswith('RTG'):
-            return (2, alias)
-        elif alias.startswith('RS'):
-            return (3, alias)
-        elif alias.startswith('FL'):
-            if alias == 'FL 99':
-                return (4, 'FL 00')  # Poner 'FL 99' en primer lugar dentro de los 'FL'
-            else:
-                return (5, alias)
-    return (6, alias)  # Para cualquier otro prefijo no considerar 
+        if alias in config_catalogo['orden_especial']:
+            return tuple(config_catalogo['orden_especial'][alias])  # p. ej. 'FL 99' primero dentro de los 'FL'
+        for prefijo, (_, rango) in categorias.items():
+            if alias.startswith(prefijo):
+                return (rango, alias)
+    return (config_catalogo['rango_otros'], alias)  # Para cualquier otro prefijo no considerar 
+
+# Catálogo precalculado por alias: cada alias se evalúa una sola vez en Python y luego
+# el enriquecimiento de cada refresco es un join vectorizado contra esta tabla
+COLUMNAS_CATALOGO = ['ajuste', 'Imagen', 'categoria', 'orden_rango', 'orden_clave', 'columna_excel']
+catalogo = None
+
+def fila_catalogo(alias):
+    categoria = next((prefijo for prefijo in categorias if alias.startswith(prefijo)), None)
+    orden_rango, orden_clave = ordenar_alias(alias)
+    return {
+        'ajuste': ajustes.get(alias, 0),
+        'Imagen': obtener_imagen(alias),
+        'categoria': categoria,
+        'orden_rango': orden_rango,
+        'orden_clave': orden_clave,
+        'columna_excel': alias_column_map.get(alias),
+    }
+
+def catalogo_para(aliases):
+    import pandas as pd
+
+    global catalogo
+    if catalogo is None:
+        catalogo = pd.DataFrame(columns=COLUMNAS_CATALOGO, index=pd.Index([], name='Alias'))
+    faltantes = pd.Index(aliases).unique().difference(catalogo.index)
+    if len(faltantes):
+        nuevos = pd.DataFrame([fila_catalogo(alias) for alias in faltantes], index=pd.Index(faltantes, name='Alias'))
+        catalogo = nuevos if catalogo.empty else pd.concat([catalogo, nuevos])
+    return catalogo
 
 def actualizar_ultima_data_valida(ntr_data, data2):
-    global last_update_time
     """
-    Guarda los DataFrames ntr_data y data2 en un archivo CSV.
+    Guarda ntr_data y data2 en el snapshot binario (escritura atómica).
     """
-    archivo_ntr_csv = 'Last_ntr_data.csv'
-    archivo_data2_csv = 'Last_data2.csv'
+    import pandas as pd
+
     try:
-        # Convertir las listas a DataFrames
-        df_ntr = pd.DataFrame(ntr_data)
         df2 = pd.DataFrame(data2['dataList'])
         df2['Alias'] = df2['serialNumber'].map(serial_to_alias)
         df2['Horometro'] = df2['totalRunningHours'].astype(float).round()
         df2['Fecha'] = pd.Timestamp.now().strftime("%d-%m-%Y")
         df2 = df2[['Alias', 'Horometro', 'Fecha']]
 
-        # Serializar las columnas JSON de ntr_data
-        df_ntr['gps'] = df_ntr['gps'].apply(json.dumps)
-        df_ntr['entradas'] = df_ntr['entradas'].apply(json.dumps)
-        df_ntr['totalizadores'] = df_ntr['totalizadores'].apply(json.dumps)
-
-        # Añadir la fecha y hora de la última actualización
-        df_ntr['last_update_time'] = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+        # Fecha y hora de la última actualización
+        fecha_actualizacion = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
 
-        # Guardar los DataFrames en archivos CSV separados
-        df_ntr.to_csv(archivo_ntr_csv, index=False)
-        df2.to_csv(archivo_data2_csv, index=False)
+        # Los campos anidados (gps, entradas, totalizadores) se guardan tal cual, sin pasar por JSON
+        guardar_snapshot(ntr_data, df2.to_dict(orient='records'), fecha_actualizacion, ARCHIVO_SNAPSHOT)
 
-        logging.info(f"Datos guardados en {archivo_ntr_csv} y {archivo_data2_csv}")
+        logging.info("Datos guardados en %s", ARCHIVO_SNAPSHOT)
         
     except Exception as e:
-        logging.error("Error al guardar los archivos CSV", exc_info=True)
+        logging.error("Error al guardar el snapshot", exc_info=True)
         raise e
 
 
 def cargar_ultima_data_valida():
     """
-    Carga los DataFrames desde archivos CSV.
+    Carga la última data válida desde el snapshot binario; si todavía no existe
+    se migra desde los archivos CSV del formato anterior.
     """
+    global last_update_time
+    snapshot = cargar_snapshot(ARCHIVO_SNAPSHOT)
+    if snapshot is not None:
+        logging.info("Datos cargados desde %s, se carga última data", ARCHIVO_SNAPSHOT)
+        last_update_time = snapshot['last_update_time']
+        return snapshot['ntr_data'], snapshot['data2']
+
     archivo_ntr_csv = 'Last_ntr_data.csv'
     archivo_data2_csv = 'Last_data2.csv'
     if os.path.exists(archivo_ntr_csv) and os.path.exists(archivo_data2_csv):
         try:
-            # Leer los DataFrames desde los archivos CSV
-            df_ntr = pd.read_csv(archivo_ntr_csv)
-            df2 = pd.read_csv(archivo_data2_csv)
-
-            logging.info(f"Datos cargados desde {archivo_ntr_csv} y {archivo_data2_csv}, se carga última data")
-
-            # Reemplazar comillas simples por comillas dobles y manejar NaN en df_ntr
-            df_ntr['gps'] = df_ntr['gps'].fillna('{}').str.replace("'", '"')
-            df_ntr['entradas'] = df_ntr['entradas'].fillna('{}').str.replace("'", '"')
-            df_ntr['totalizadores'] = df_ntr['totalizadores'].fillna('{}').str.replace("'", '"')
-
-            # Deserializar columnas JSON en df_ntr
-            df_ntr['gps'] = df_ntr['gps'].apply(safe_json_loads)
-            df_ntr['entradas'] = df_ntr['entradas'].apply(safe_json_loads)
-            df_ntr['totalizadores'] = df_ntr['totalizadores'].apply(safe_json_loads)
-
-            # Convertir el DataFrame en una lista de diccionarios
-            ntr_data = df_ntr.to_dict(orient='records')
-
-            # Convertir df2 en una lista de diccionarios
-            data2 = df2.to_dict(orient='records')
+            ntr_data, data2, fecha_actualizacion = cargar_csv_legado(archivo_ntr_csv, archivo_data2_csv)
+            logging.info("Datos cargados desde %s y %s, se migran a %s", archivo_ntr_csv, archivo_data2_csv, ARCHIVO_SNAPSHOT)
 
             # Extraer la fecha y hora de la última actualización
-            if 'last_update_time' in df_ntr.columns:
-                global last_update_time
-                last_update_time = df_ntr['last_update_time'].iloc[0]
+            if fecha_actualizacion is not None:
+                last_update_time = fecha_actualizacion
+            guardar_snapshot(ntr_data, data2, last_update_time, ARCHIVO_SNAPSHOT)
 
             return ntr_data, data2
         except Exception as e:
             logging.error("Error al cargar los archivos CSV", exc_info=True)
             raise e
     else:
-        logging.warning(f"Archivos {archivo_ntr_csv} o {archivo_data2_csv} no encontrados.")
+        logging.warning("No se encontró %s ni los archivos %s y %s.", ARCHIVO_SNAPSHOT, archivo_ntr_csv, archivo_data2_csv)
         return [], []  # Retorna dos listas vacías si los archivos no existen
 
 
-# Carga inicial de los datos
-last_valid_data = cargar_ultima_data_valida()
+# La última data válida se carga en el hilo de refresco, después de que el servidor arrancó
+last_valid_data = None
 
-def obtener_datos():
-    global last_api_call, api_wait_time
+def obtener_datos(plazo=None):
+    import requests
 
     url = "https://api.caesistemas.com.ar/v1/ntr.php"
     params = {"api_key": "xxx"}
 
     try:
-        current_time = time.time()
-        if current_time < last_api_call + api_wait_time:
+        if cliente_cae.en_espera():
             logging.warning("Llamadas a la API demasiado frecuentes. Esperando...")
             return None
             
         logging.info("Enviando solicitud a la API...")
-        response = requests.get(url, params=params, verify=False, timeout=10)
+        response = cliente_cae.get(url, params=params, plazo=plazo)
 
         if response.status_code == 200:
             logging.info("Solicitud exitosa")
@@ -188,14 +293,12 @@ def obtener_datos():
                 logging.warning("Esperando...")
                 mensaje = estado.get("mensaje")
                 tiempo_espera = int(mensaje.split(" ")[1])
-                logging.info(f"Esperando {tiempo_espera} segundos antes de intentar nuevamente...")
-                last_api_call = time.time()
-                api_wait_time = tiempo_espera
+                logging.info("Esperando %s segundos antes de intentar nuevamente...", tiempo_espera)
+                cliente_cae.registrar_espera(tiempo_espera)
                 return None
             elif codigo == 0:
                 logging.info("Datos disponibles para procesar")
-                last_api_call = time.time()
-                api_wait_time = 0  # Resetear el tiempo de espera si la llamada fue exitosa
+                cliente_cae.registrar_exito()
                 return data["datos"]["ntr"]
             else:
                 mensaje = estado.get("mensaje")
@@ -203,39 +306,78 @@ def obtener_datos():
         else:
             raise Exception("Error al obtener los datos de la API:", response.status_code)
         
+    except (CircuitoAbierto, PlazoAgotado) as e:
+        # Se usa la última data válida sin esperar el timeout de la API
+        logging.warning("API CAE NTR no disponible: %s", e)
+        return None
     except requests.exceptions.RequestException as e:
-        logging.error(f"Error de conexión: {e}")        
+        logging.error("Error de conexión: %s", e)
+        return None
     except Exception as e:
         logging.error("Error inesperado en obtener_datos", exc_info=True)
         return None
     
-def obtener_datos2():
+def obtener_datos2(plazo=None):
+    import requests
+
     url2 = "https://cloud-api.digi.kalmarglobal.com/runningHours"
     headers = {"X-API-KEY": "xxx"}
 
     try:
-        response2 = requests.get(url2, headers=headers, verify=False)
+        if cliente_kalmar.en_espera():
+            logging.warning("Llamadas a la segunda API demasiado frecuentes. Esperando...")
+            return None
+
+        response2 = cliente_kalmar.get(url2, headers=headers, plazo=plazo)
 
         if response2.status_code == 200:
             logging.info("Solicitud exitosa a la segunda API")
+            cliente_kalmar.registrar_exito()
             return response2.json()
         else:
             raise Exception("Error al obtener los datos de la API de running hours:", response2.status_code)
+    except (CircuitoAbierto, PlazoAgotado) as e:
+        logging.warning("API Kalmar no disponible: %s", e)
+        return None
     except requests.exceptions.RequestException as e:
-        logging.error(f"Error de conexión a la segunda API: {e}")
+        logging.error("Error de conexión a la segunda API: %s", e)
+        return None
+    except Exception as e:
+        logging.error("Error inesperado en obtener_datos2", exc_info=True)
         return None
+
+# Función para consultar ambas APIs en paralelo con un plazo total
+# El plazo se pasa a cada cliente para que sus reintentos no lo superen
+
+def obtener_datos_en_paralelo():
+    plazo = Plazo(PLAZO_APIS)
+    futuro_ntr = executor_apis.submit(obtener_datos, plazo)
+    futuro_kalmar = executor_apis.submit(obtener_datos2, plazo)
+    limite = time.monotonic() + PLAZO_APIS
+
+    resultados = []
+    for nombre, futuro in (('CAE NTR', futuro_ntr), ('Kalmar', futuro_kalmar)):
+        try:
+            resultados.append(futuro.result(timeout=max(0, limite - time.monotonic())))
+        except FuturesTimeoutError:
+            logging.error("La API %s superó el plazo de %s segundos", nombre, PLAZO_APIS)
+            resultados.append(None)
+    return tuple(resultados)
     
 def procesar_datos2(data2):
+    import pandas as pd
+
     try:
-        if 'dataList' in data2:  # Verifica si data2 tiene la clave 'dataList'
-            df2 = pd.DataFrame(data2['dataList'])
-        else:
-            df2 = pd.DataFrame(data2)
+        with medir('parseo_kalmar'):
+            if 'dataList' in data2:  # Verifica si data2 tiene la clave 'dataList'
+                df2 = pd.DataFrame(data2['dataList'])
+            else:
+                df2 = pd.DataFrame(data2)
 
-        df2['Alias'] = df2['serialNumber'].map(serial_to_alias)
-        df2['Horometro'] = df2['totalRunningHours'].astype(float).round()
-        df2['Fecha'] = pd.Timestamp.now().strftime("%d-%m-%Y")
-        df2 = df2[['Alias', 'Horometro', 'Fecha']]
+            df2['Alias'] = df2['serialNumber'].map(serial_to_alias)
+            df2['Horometro'] = df2['totalRunningHours'].astype(float).round()
+            df2['Fecha'] = pd.Timestamp.now().strftime("%d-%m-%Y")
+            df2 = df2[['Alias', 'Horometro', 'Fecha']]
         return df2
     except Exception as e:
         logging.error("Error en procesar_datos2", exc_info=True)
@@ -245,13 +387,31 @@ def obtener_imagen(alias):
     for prefijo, imagen in imagen_por_alias.items():
         if alias.startswith(prefijo):
             return imagen
-    return 'Imagen no encontrada'  # Si no se encuentra ningún prefijo
+    return config_catalogo['imagen_por_defecto']  # Si no se encuentra ningún prefijo
+
+# Función para escribir un archivo de forma atómica: se escribe un temporal en el mismo
+# directorio (con la misma extensión, para los writers de Excel) y luego se renombra
+
+def escribir_atomico(ruta, escribir):
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    base, extension = os.path.splitext(os.path.basename(ruta))
+    fd, tmp = tempfile.mkstemp(dir=directorio, prefix=f'.{base}_', suffix=extension)
+    os.close(fd)
+    try:
+        escribir(tmp)
+        os.replace(tmp, ruta)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 def actualizar_excel_forklift(df_filtrado):
+    from openpyxl import load_workbook
+
     try:
         archivo_excel = 'Forklift_Horometros.xlsx'
         ruta_completa = os.path.abspath(archivo_excel)
-        logging.info(f'Intentando cargar el archivo Excel: {ruta_completa}')
+        logging.info('Intentando cargar el archivo Excel: %s', ruta_completa)
 
         wb = load_workbook(archivo_excel)
         ws = wb.active
@@ -269,37 +429,179 @@ def actualizar_excel_forklift(df_filtrado):
                 ws[f'{columna}9'] = horometro
                 ws[f'{columna}10'] = fecha_actual
 
-        wb.save(archivo_excel)
-        logging.info(F'Datos actualizados en {ruta_completa}.')
+        escribir_atomico(archivo_excel, wb.save)
+        logging.info('Datos actualizados en %s.', ruta_completa)
 
     except FileNotFoundError:
-        logging.error(f'Archivo no encontrado: {ruta_completa}')
+        logging.error('Archivo no encontrado: %s', ruta_completa)
     except BadZipFile:
-        logging.error(f'El archivo no es un archivo zip válido o está corrupto: {ruta_completa}')
+        logging.error('El archivo no es un archivo zip válido o está corrupto: %s', ruta_completa)
     except Exception as e:
         logging.error("Error inesperado en actualizar_excel_forklift", exc_info=True)
         raise e  
 
+class ExportadorArchivos:
+    """
+    Exporta horometros_anteriores, df_filtrado y Forklift_Horometros.xlsx desde un hilo
+    en segundo plano. Los pedidos que llegan dentro de la ventana de debounce se agrupan
+    (solo se exporta el último) y cada archivo se reescribe únicamente si su contenido cambió.
+    """
+
+    def __init__(self, debounce=60):
+        self.debounce = debounce
+        self._pendiente = None
+        self._ultimo_exportado = {}
+        self._cond = threading.Condition()
+        # Serializa las exportaciones: la de atexit espera a que termine la del hilo, y como
+        # el pedido pendiente se toma dentro del lock, siempre se escribe último el más nuevo
+        self._lock_exportacion = threading.Lock()
+        self._hilo = None
+
+    def programar(self, df_horometros, df_filtrado):
+        with self._cond:
+            # El hilo se inicia con el primer pedido de exportación
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name='exportador-archivos', daemon=True)
+                self._hilo.start()
+            self._pendiente = (df_horometros.copy(), df_filtrado.copy())
+            self._cond.notify()
+
+    def vaciar(self):
+        # Exporta de inmediato lo pendiente (se usa al cerrar el proceso)
+        with self._lock_exportacion:
+            with self._cond:
+                pendiente, self._pendiente = self._pendiente, None
+            if pendiente is not None:
+                with medir('exportacion_archivos'):
+                    self._exportar(*pendiente)
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while self._pendiente is None:
+                    self._cond.wait()
+            # Se espera la ventana de debounce y se toma el pedido más reciente
+            time.sleep(self.debounce)
+            try:
+                self.vaciar()
+            except Exception:
+                logging.error("Error al exportar archivos", exc_info=True)
+
+    def _cambio(self, clave, contenido):
+        return self._ultimo_exportado.get(clave) != contenido
+
+    def _exportar(self, df_horometros, df_filtrado):
+        # Guardar el DataFrame actualizado como CSV y Excel
+        csv_horometros = df_horometros.to_csv(index=False)
+        if self._cambio('horometros', csv_horometros):
+            escribir_atomico('horometros_anteriores.csv', lambda tmp: df_horometros.to_csv(tmp, index=False))
+            escribir_atomico('horometros_anteriores.xlsx', lambda tmp: df_horometros.to_excel(tmp, index=True))
+            self._ultimo_exportado['horometros'] = csv_horometros
+            logging.info("Historial guardado como 'horometros_anteriores.csv'.")
+
+        csv_filtrado = df_filtrado.to_csv(index=False)
+        if self._cambio('filtrado', csv_filtrado):
+            escribir_atomico('df_filtrado.csv', lambda tmp: df_filtrado.to_csv(tmp, index=False))
+            escribir_atomico('df_filtrado.xlsx', lambda tmp: df_filtrado.to_excel(tmp, index=False))
+            self._ultimo_exportado['filtrado'] = csv_filtrado
+            logging.info("DataFrame filtrado guardado como 'df_filtrado.csv'.")
+
+        # El Excel de forklifts solo se abre con openpyxl si cambió algún valor o la fecha
+        valores_forklift = (
+            datetime.datetime.now().strftime('%d/%m/%Y'),
+            tuple((alias, round(horometro)) for alias, horometro in zip(df_filtrado['Alias'], df_filtrado['Horometro']) if alias in alias_column_map),
+        )
+        if self._cambio('forklift', valores_forklift):
+            with medir('exportacion_excel_forklift'):
+                actualizar_excel_forklift(df_filtrado)
+            self._ultimo_exportado['forklift'] = valores_forklift
+
+exportador = ExportadorArchivos(debounce=int(os.environ.get('DEBOUNCE_EXPORTACION', 60)))
+atexit.register(exportador.vaciar)
+
+# Historial semanal de horómetros en memoria (se carga desde el CSV en el primer refresco)
+historial_horometros = None
+
+# Historial completo de lecturas para consultas de tendencia por alias y rango de fechas
+# (la base SQLite se abre en el primer refresco)
+historial_lecturas = None
+
+def obtener_historial_lecturas():
+    global historial_lecturas
+    if historial_lecturas is None:
+        historial_lecturas = HistorialHorometros(
+            retencion_dias=int(os.environ.get('HISTORIAL_RETENCION_DIAS', 730)),
+            compactar_despues_dias=int(os.environ.get('HISTORIAL_COMPACTAR_DIAS', 30)),
+        )
+    return historial_lecturas
+
+# Función para comparar los horómetros actuales con los de la semana anterior
+# Todo el cálculo se hace por columnas con el historial indexado por alias: diferencias,
+# chequeo de tiempo transcurrido y altas de alias nuevos en una sola pasada
+
+def comparar_horometros_semanales(df_filtrado, df_horometros, ahora=None):
+    import pandas as pd
+
+    if ahora is None:
+        ahora = datetime.datetime.now().timestamp()
+
+    actuales = df_filtrado[df_filtrado['Alias'].str.startswith(('FL', 'RS', 'GR', 'RTG'))]
+    actuales = actuales.drop_duplicates(subset='Alias', keep='first')
+    horometro_actual = actuales.set_index('Alias')['Horometro']
+
+    # Para cada alias se toma el primer registro del historial
+    anteriores = df_horometros.drop_duplicates(subset='alias', keep='first').set_index('alias')
+    comunes = horometro_actual.index[horometro_actual.index.isin(anteriores.index)]
+    tiempo_transcurrido = ahora - anteriores.loc[comunes, 'timestamp']
+    vencidos = tiempo_transcurrido.index[tiempo_transcurrido >= 603000] #604800
+
+    diferencias = horometro_actual[vencidos] - anteriores.loc[vencidos, 'horometro']
+    for alias, diferencia in diferencias.items():
+        logging.info("Alias: %s, Horometro semana anterior: %s, Horometro semana actual: %s, Diferencia: %s", alias, anteriores.at[alias, 'horometro'], horometro_actual[alias], diferencia)
+
+    # Se actualizan todas las filas del historial de los alias vencidos
+    mask = df_horometros['alias'].isin(vencidos)
+    if mask.any():
+        alias_vencidos = df_horometros.loc[mask, 'alias']
+        df_horometros.loc[mask, 'horometro'] = alias_vencidos.map(horometro_actual).values
+        df_horometros.loc[mask, 'timestamp'] = ahora
+        df_horometros.loc[mask, 'diferencia'] = alias_vencidos.map(diferencias).values
+
+    # Los alias que no estaban en el historial se agregan con un único concat
+    nuevos = actuales[~actuales['Alias'].isin(df_horometros['alias'])]
+    if not nuevos.empty:
+        new_rows = pd.DataFrame({
+            'alias': nuevos['Alias'].values,
+            'horometro': nuevos['Horometro'].values,
+            'timestamp': ahora,
+            'diferencia': 0
+        })
+        df_horometros = pd.concat([df_horometros, new_rows], ignore_index=True)
+
+    return df_horometros
+
 def procesar_datos():
-    global last_valid_data, last_update_time, api_wait_time, last_api_call
+    import pandas as pd
+
+    global last_valid_data, last_update_time, historial_horometros
     try:
-        ntr_data = obtener_datos()
-        data2 = obtener_datos2()
+        ntr_data, data2 = obtener_datos_en_paralelo()
 
         df2 = procesar_datos2(data2)
+        datos_nuevos = ntr_data is not None
 
         if ntr_data is None:
             if last_valid_data is not None:
                 ntr_data, data2 = last_valid_data
                 if df2.empty:
                     df2 = procesar_datos2(last_valid_data[1])
-                logging.info(f"Usando la última data válida.{last_valid_data}")
+                # Solo se loguea un resumen acotado (cantidad de registros y los primeros elementos)
+                logging.info("Usando la última data válida. %s", Resumen(last_valid_data))
             else:
                 raise Exception("No hay datos válidos disponibles.")
         else:
             logging.info("Actualizando la última data válida.")
             last_update_time = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-            last_api_call = time.time()  # Actualizar el tiempo de la última llamada API
             last_valid_data = (ntr_data, data2)
             actualizar_ultima_data_valida(ntr_data, data2)
             # Actualizar el tiempo de última actualización
@@ -308,86 +610,48 @@ def procesar_datos():
         logging.error("Error en procesar_datos", exc_info=True)
         raise e
 
-    alias_list = [item['alias'] for item in ntr_data]
-    horometro_list = [item['totalizadores']['horometro'] for item in ntr_data]
-
-    df = pd.DataFrame({'Alias': alias_list, 'Horometro': horometro_list})
-
-    # Unir los datos de las dos APIs
-    df = pd.concat([df, df2]).drop_duplicates(subset='Alias', keep='last')
-
-    ajustes = {
-        'FL 103': 4142,
-        'FL 104': 60,
-        'FL 105': 27,
-        'FL 106': 6323,
-        'FL 107': 33,
-        'FL 99': 4752,
-        'FL 501': 40,
-        'GR08': 2994,
-        'GR09': 2240,
-        'GR10': -33,
-        'RTG02': 20598,
-        'RTG11': 154,
-        'RTG16': 547,
-        'RTG17': 39,
-        'RTG20': 47928,
-        'RTG24': 31763,
-        'RTG26': 13517,
-        'RTG31': 20138,
-        'RS 39': 38894,
-        'RS 40': 201,
-    }
+    with medir('parseo_ntr'):
+        alias_list = [item['alias'] for item in ntr_data]
+        horometro_list = [item['totalizadores']['horometro'] for item in ntr_data]
 
-    df['Horometro'] = df.apply(lambda row: row['Horometro'] + ajustes.get(row['Alias'], 0), axis=1)
-    df['Fecha'] = pd.Timestamp.now().strftime("%d-%m-%Y")
-
-    # Aplicar la función obtener_imagen usando lambda
-    df['Imagen'] = df['Alias'].apply(lambda x: obtener_imagen(x))
-
-    # Convertir todos los valores en la columna Alias a cadenas de texto
-    df['Alias'] = df['Alias'].astype(str)
-
-    df_filtrado = df[df['Alias'].str.startswith(('RS', 'RTG', 'GR', 'FL'))]
-    # Aplicar la función de orden personalizada
-    df_filtrado = df_filtrado.sort_values(by='Alias', key=lambda x: x.map(ordenar_alias))
-
-    df_horometros = pd.read_csv('horometros_anteriores.csv')
-    logging.info("Archivo CSV cargado exitosamente para comparar valores semanales.")
-
-    for _, row in df_filtrado.iterrows():
-        alias = row['Alias']
-        horometro_actual = row['Horometro']
-        if alias.startswith('FL') or alias.startswith('RS') or alias.startswith('GR') or alias.startswith('RTG'):
-            if alias in df_horometros['alias'].values:
-                horometro_anterior = df_horometros.loc[df_horometros['alias'] == alias, 'horometro'].values[0]
-                timestamp_anterior = df_horometros.loc[df_horometros['alias'] == alias, 'timestamp'].values[0]
-                tiempo_transcurrido = datetime.datetime.now().timestamp() - timestamp_anterior
-                logging.info(f"Tiempo transcurrido: {tiempo_transcurrido}")
-                if tiempo_transcurrido >= 603000: #604800
-                    diferencia = horometro_actual - horometro_anterior
-                    logging.info(f"Alias: {alias}, Horometro semana anterior: {horometro_anterior}, Horometro semana actual: {horometro_actual}, Diferencia: {diferencia}")
-                    df_horometros.loc[df_horometros['alias'] == alias, 'horometro'] = horometro_actual
-                    df_horometros.loc[df_horometros['alias'] == alias, 'timestamp'] = datetime.datetime.now().timestamp()
-                    df_horometros.loc[df_horometros['alias'] == alias, 'diferencia'] = diferencia
-            else:
-                new_row = pd.DataFrame({
-                    'alias': [alias],
-                    'horometro': [horometro_actual],
-                    'timestamp': [datetime.datetime.now().timestamp()],
-                    'diferencia': [0]
-                })
-                df_horometros = pd.concat([df_horometros, new_row], ignore_index=True)
-
-    # Guardar el DataFrame actualizado como un archivo Excel
-    df_horometros.to_excel('horometros_anteriores.xlsx', index=True)
-    # Y CSV
-    df_horometros.to_csv('horometros_anteriores.csv', index=False)
-    df_filtrado.to_csv('df_filtrado.csv', index=False)
-    df_filtrado.to_excel('df_filtrado.xlsx', index=False)
-    logging.info("DataFrame filtrado guardado como 'df_filtrado.csv'.")
-
-    actualizar_excel_forklift(df_filtrado)
+        df = pd.DataFrame({'Alias': alias_list, 'Horometro': horometro_list})
+
+    with medir('enriquecimiento'):
+        # Unir los datos de las dos APIs
+        df = pd.concat([df, df2]).drop_duplicates(subset='Alias', keep='last')
+
+        # Convertir todos los valores en la columna Alias a cadenas de texto
+        df['Alias'] = df['Alias'].astype(str)
+
+        # Enriquecimiento con un único join contra el catálogo (ajuste, imagen, categoría, orden)
+        df = df.join(catalogo_para(df['Alias']), on='Alias')
+        df['Horometro'] = df['Horometro'] + df['ajuste']
+        df['Fecha'] = pd.Timestamp.now().strftime("%d-%m-%Y")
+
+        df_filtrado = df[df['categoria'].notna()]
+        # Orden personalizado precalculado en el catálogo
+        df_filtrado = df_filtrado.sort_values(by=['orden_rango', 'orden_clave'])
+        df_filtrado = df_filtrado[['Alias', 'Horometro', 'Fecha', 'Imagen']]
+
+    # El historial se mantiene en memoria porque la exportación a disco es asíncrona
+    if historial_horometros is None:
+        historial_horometros = pd.read_csv('horometros_anteriores.csv')
+        logging.info("Archivo CSV cargado exitosamente para comparar valores semanales.")
+
+    with medir('comparacion_semanal'):
+        historial_horometros = comparar_horometros_semanales(df_filtrado, historial_horometros)
+
+    # Cada lectura nueva se agrega al historial indexado por (alias, tiempo)
+    if datos_nuevos:
+        with medir('historial_sqlite'):
+            historial = obtener_historial_lecturas()
+            historial.agregar_lecturas(zip(df_filtrado['Alias'], df_filtrado['Horometro']))
+            historial.mantener_si_corresponde()
+    else:
+        incrementar('refrescos_con_data_anterior')
+
+    # Los archivos Excel/CSV se escriben en segundo plano y solo si cambiaron
+    exportador.programar(historial_horometros, df_filtrado)
     logging.info("Proceso completado.")
 
     return df_filtrado
@@ -395,74 +659,246 @@ def procesar_datos():
 # Crear la aplicación Dash
 app = dash.Dash(__name__)
 
-# Layout de la aplicación
-app.layout = html.Div(style={'backgroundColor': '#C0C0C0'},children=[
+# Servidor WSGI para producción, p. ej.:
+#   MODO_PRODUCCION=1 gunicorn -w 4 -b 0.0.0.0:8050 "Api_Pull_Request+DashApp:server"
+# (sin --preload, para que cada worker inicie su propio hilo de refresco)
+server = app.server
+
+# Tiempos y contadores por etapa en formato Prometheus
+# Con gunicorn cada worker tiene su propio registro (solo el líder mide las APIs, el refresco y
+# la exportación) y cada scrape llega a un worker cualquiera: por eso cada worker publica su
+# resumen en el estado compartido y /metrics devuelve las series de todos, con la etiqueta 'worker'
+def publicar_metricas():
+    estado_compartido.escribir(f'metricas:{WORKER_ID}', metricas.resumen())
+
+@server.route('/metrics')
+def metricas_prometheus():
+    if estado_compartido is None:
+        texto = metricas.formato_prometheus({'worker': WORKER_ID})
+    else:
+        publicar_metricas()
+        # Se omiten los workers que dejaron de publicar (p. ej. reiniciados por gunicorn)
+        resumenes = estado_compartido.leer_prefijo('metricas:', max_antiguedad=DURACION_LIDERAZGO)
+        texto = formato_prometheus_combinado([
+            ({'worker': clave[len('metricas:'):]}, resumen) for clave, resumen in sorted(resumenes.items())
+        ])
+    return texto, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Intervalo de lectura del snapshot; mientras todavía no hay uno publicado se consulta más seguido
+INTERVALO_TABLERO_MS = 5*60*1000
+INTERVALO_ESPERA_MS = 5*1000
+
+# Layout de la aplicación (los estilos están en assets/equipos.css)
+app.layout = html.Div(className='tablero', children=[
     html.H1(className='header', children=[
-        html.H1(children='Horómetros de Equipos', style={'text-align': 'center','background-color': '#C0C0C0'}),
+        html.H1(children='Horómetros de Equipos', className='titulo'),
     ]),
 
     dcc.Interval(
         id='interval-component',
-        interval= 3600*1000,  # Actualizar cada 1 hora
+        interval=INTERVALO_TABLERO_MS,  # Leer el snapshot cada 5 minutos (el refresco de datos corre en segundo plano)
         n_intervals=0
     ),
 
-    # Añadir dcc.Store para almacenar los datos
+    # dcc.Store guarda solo la estructura y los horómetros que ya tiene el navegador
     dcc.Store(id='stored-data'),
 
-    html.Div(id='live-update-text', style={'text-align': 'center', 'font-size': '24px', 'font-weight': 'bold','background-color': '#C0C0C0'}),
-    html.Div(id='images', style={'display': 'flex', 'flex-wrap': 'wrap', 'justify-content': 'center','background-color': '#C0C0C0'})
+    html.Div(id='live-update-text', className='live-update-text'),
+    html.Div(id='images', className='equipos')
 ])
 
+# Función para construir las tarjetas de cada equipo a partir de df_filtrado
+# Cada texto tiene un id estable por alias y se devuelve su posición dentro de 'images'
+# para poder actualizar solo las tarjetas que cambiaron
+
+def texto_tarjeta(alias, horometro):
+    return f'{alias} - Horómetro: {horometro}'
+
+def construir_tarjetas(df_filtrado):
+    # Crear elementos de imagen y texto para cada equipo
+    images = []
+    posiciones = {}
+    categories = {prefijo: titulo for prefijo, (titulo, _) in categorias.items()}
+    added_categories = set()
+
+    for alias, horometro, imagen in zip(df_filtrado['Alias'], df_filtrado['Horometro'], df_filtrado['Imagen']):
+
+        category_prefix = next((prefix for prefix in categories if alias.startswith(prefix)), None)
+
+        if category_prefix and category_prefix not in added_categories:
+            images.append(html.H2(children=categories[category_prefix], className='categoria'))
+            added_categories.add(category_prefix)
+
+        posiciones[alias] = len(images)
+        images.append(html.Div(className='equipment-container', id={'type': 'equipo', 'index': alias}, children=[
+            html.Img(src=f'/assets/{imagen}.png', className='equipment-image'),
+            html.Div(texto_tarjeta(alias, horometro), className='equipment-text', id={'type': 'equipo-texto', 'index': alias})
+        ]))
+
+    return images, posiciones
+
+# Snapshot inmutable con todo lo que necesita el callback; lo publica el hilo de refresco
+Snapshot = namedtuple('Snapshot', ['tarjetas', 'posiciones', 'estructura', 'horometros', 'last_update_time', 'last_api_call', 'api_wait_time'])
+
+# Con RENDER_INCREMENTAL=0 se envía siempre el árbol completo de tarjetas
+RENDER_INCREMENTAL = os.environ.get('RENDER_INCREMENTAL', '1') != '0'
+
+snapshot_actual = None
+
+# Intervalo del refresco en segundo plano (por defecto 1 hora, como el dcc.Interval original)
+INTERVALO_REFRESCO = int(os.environ.get('INTERVALO_REFRESCO', 3600))
+
+# Archivo con el último tablero publicado, para que todos los workers sirvan el mismo snapshot
+ARCHIVO_TABLERO = 'snapshot_tablero.pkl'
+INTERVALO_SINCRONIZACION = int(os.environ.get('INTERVALO_SINCRONIZACION', 15))
+# Si el líder deja de renovar su liderazgo durante este tiempo, otro worker toma el refresco
+DURACION_LIDERAZGO = int(os.environ.get('DURACION_LIDERAZGO', 120))
+version_local = None
+
+def publicar_snapshot(df_filtrado, fecha_actualizacion):
+    global snapshot_actual
+    tarjetas, posiciones = construir_tarjetas(df_filtrado)
+    # La estructura identifica el árbol de tarjetas (orden de alias e imágenes); si no
+    # cambia, al navegador le alcanza con recibir los textos modificados
+    estructura = hashlib.sha1(repr(list(zip(df_filtrado['Alias'], df_filtrado['Imagen']))).encode('utf-8')).hexdigest()
+    # Se arma el snapshot completo y se publica con una sola asignación (atómica)
+    snapshot_actual = Snapshot(
+        tarjetas=tuple(tarjetas),
+        posiciones=posiciones,
+        estructura=estructura,
+        horometros={alias: str(horometro) for alias, horometro in zip(df_filtrado['Alias'], df_filtrado['Horometro'])},
+        last_update_time=fecha_actualizacion,
+        last_api_call=cliente_cae.last_api_call,
+        api_wait_time=cliente_cae.api_wait_time,
+    )
+    logging.info("Nuevo snapshot publicado.")
+
+def refrescar_snapshot():
+    global version_local
+    with medir('refresco'):
+        df_filtrado = procesar_datos()
+    publicar_snapshot(df_filtrado, last_update_time)
+
+    # En modo producción el tablero se comparte con el resto de los workers
+    if estado_compartido is not None:
+        version_local = f"{WORKER_ID}:{time.time()}"
+        guardar_pickle_atomico({'df_filtrado': df_filtrado, 'last_update_time': last_update_time}, ARCHIVO_TABLERO)
+        estado_compartido.escribir('tablero', {'version': version_local, 'refrescado': time.time()})
+
+def sincronizar_snapshot():
+    # Un worker que no es líder solo recarga el tablero cuando cambió su versión
+    global version_local
+    tablero = estado_compartido.leer('tablero')
+    if tablero is None or tablero['version'] == version_local:
+        return
+    datos = cargar_pickle(ARCHIVO_TABLERO)
+    if datos is not None:
+        version_local = tablero['version']
+        publicar_snapshot(datos['df_filtrado'], datos['last_update_time'])
+
+def refresco_vencido():
+    # Se cuenta desde el último intento, exitoso o no: si procesar_datos falla, el líder
+    # no vuelve a llamar a las APIs en cada vuelta de sincronización
+    ultimo_intento = estado_compartido.leer('refresco_intento')
+    return ultimo_intento is None or time.time() - ultimo_intento >= INTERVALO_REFRESCO
+
+def bucle_refresco():
+    global last_valid_data
+    es_lider = False
+    if estado_compartido is None:
+        # Carga inicial de la última data válida, ya con el servidor atendiendo solicitudes
+        try:
+            with medir('carga_inicial'):
+                last_valid_data = cargar_ultima_data_valida()
+        except Exception:
+            logging.error("Error al cargar la última data válida", exc_info=True)
+    while True:
+        try:
+            if estado_compartido is None:
+                refrescar_snapshot()
+            else:
+                publicar_metricas()
+                # Solo el worker líder llama a las APIs; el liderazgo se renueva en cada vuelta
+                lider = estado_compartido.tomar_liderazgo('refresco', WORKER_ID, ttl=DURACION_LIDERAZGO)
+                if lider and not es_lider:
+                    # Al asumir el liderazgo se toma la última data válida guardada por el líder anterior
+                    last_valid_data = cargar_ultima_data_valida()
+                es_lider = lider
+                if es_lider and refresco_vencido():
+                    estado_compartido.escribir('refresco_intento', time.time())
+                    refrescar_snapshot()
+                else:
+                    sincronizar_snapshot()
+        except Exception:
+            # Si falla se sigue sirviendo el último snapshot publicado
+            logging.error("Error al refrescar el snapshot", exc_info=True)
+        time.sleep(INTERVALO_REFRESCO if estado_compartido is None else INTERVALO_SINCRONIZACION)
+
+hilo_refresco = None
+lock_refresco = threading.Lock()
+
+def iniciar_refresco():
+    # Inicia el hilo de refresco una sola vez por proceso, sea cual sea el servidor
+    # (python, gunicorn, flask run) que importó el módulo
+    global hilo_refresco
+    with lock_refresco:
+        if hilo_refresco is None:
+            hilo_refresco = threading.Thread(target=bucle_refresco, name='refresco-datos', daemon=True)
+            hilo_refresco.start()
+    return hilo_refresco
+
 @app.callback(
     [Output('live-update-text', 'children'),
      Output('images', 'children'),
-     Output('stored-data', 'data')],
-    [Input('interval-component', 'n_intervals')]
+     Output('stored-data', 'data'),
+     Output('interval-component', 'interval')],
+    [Input('interval-component', 'n_intervals')],
+    [State('stored-data', 'data')]
 )
 
-def display_data(n):
-    global last_update_time, api_wait_time, last_api_call
-    try:
-        df_filtrado = procesar_datos()
-
-        last_update_text = f'Última actualización: {last_update_time}'
+def display_data(n, datos_cliente):
+    # El callback solo lee el snapshot publicado; no llama a las APIs ni escribe archivos
+    # El refresco se inicia con la primera solicitud si el servidor no lo inició antes
+    iniciar_refresco()
+    snapshot = snapshot_actual
+    if snapshot is None:
+        # Sin snapshot todavía no se bloquea la solicitud: se vuelve a consultar en unos segundos
+        return html.P("Cargando datos..."), no_update, no_update, INTERVALO_ESPERA_MS
 
-        # Calcular el tiempo restante para la próxima actualización
-        current_time = time.time()
-        tiempo_restante = max(0, last_api_call + api_wait_time - current_time)
-        minutos_restantes = tiempo_restante // 60 if tiempo_restante > 0 else api_wait_time // 60
-        update_info_text = f'{last_update_text}   -   Próxima actualización aproximada en: {int(minutos_restantes)} minutos'
+    last_update_text = f'Última actualización: {snapshot.last_update_time}'
 
-        # Crear elementos de imagen y texto para cada equipo
-        images = []
-        categories = {'GR': 'GRÚAS', 'RTG': 'RTG', 'RS': 'REACHSTAKER', 'FL': 'FORKLIFT'}
-        added_categories = set()
-        
-        for _, equipo in df_filtrado.iterrows():
+    # Calcular el tiempo restante para la próxima actualización
+    current_time = time.time()
+    tiempo_restante = max(0, snapshot.last_api_call + snapshot.api_wait_time - current_time)
+    minutos_restantes = tiempo_restante // 60 if tiempo_restante > 0 else snapshot.api_wait_time // 60
+    update_info_text = f'{last_update_text}   -   Próxima actualización aproximada en: {int(minutos_restantes)} minutos'
 
-            alias = equipo['Alias']
-            category_prefix = next((prefix for prefix in categories if alias.startswith(prefix)), None)
+    # Aplicar estilos CSS al texto de última actualización
+    last_update_element = html.Div(update_info_text, className='texto-actualizacion')
 
-            if category_prefix and category_prefix not in added_categories:
-                images.append(html.H2(children=categories[category_prefix], style={'width': '100%', 'text-align': 'center','font-size': '32px','font-weight': 'bold','margin-top': '20px','background-color': '#C0C0C0'}))
-                added_categories.add(category_prefix)
+    datos_nuevos = {'estructura': snapshot.estructura, 'horometros': snapshot.horometros}
 
-            images.append(html.Div(className='equipment-container', children=[
-                html.Img(src=f'/assets/{equipo["Imagen"]}.png', className='equipment-image', style={'width': '180px', 'height': '100px'}),
-                html.Div(f'{equipo["Alias"]} - Horómetro: {equipo["Horometro"]}', className='equipment-text', style={'font-size': '20px', 'font-weight': 'bold'})
-            ], style={'margin': '20px', 'padding': '10px', 'border': '1px solid #ddd', 'border-radius': '10px', 'text-align': 'center','background-color': '#ADD8E6'}))
+    # Si el navegador ya tiene el mismo árbol de tarjetas se envían solo los textos que cambiaron
+    if RENDER_INCREMENTAL and datos_cliente and datos_cliente.get('estructura') == snapshot.estructura:
+        anteriores = datos_cliente.get('horometros', {})
+        cambiados = [alias for alias, horometro in snapshot.horometros.items() if anteriores.get(alias) != horometro]
+        if not cambiados:
+            return last_update_element, no_update, no_update, INTERVALO_TABLERO_MS
 
-        # Aplicar estilos CSS al texto de última actualización
-        last_update_element = html.Div(update_info_text, style={'font-size': '30px', 'font-weight': 'bold'})
+        images = Patch()
+        for alias in cambiados:
+            posicion = snapshot.posiciones[alias]
+            images[posicion]['props']['children'][1]['props']['children'] = texto_tarjeta(alias, snapshot.horometros[alias])
+        return last_update_element, images, datos_nuevos, INTERVALO_TABLERO_MS
 
-        # Devolver el texto, las imágenes y los datos almacenados
-        return last_update_element, images, df_filtrado.to_dict('records')
-
-    except Exception as e:
-        logging.error("Error al procesar datos", exc_info=True)
-        return html.P("Error al procesar datos."), [], []
+    # Devolver el texto, las imágenes y los datos almacenados
+    return last_update_element, list(snapshot.tarjetas), datos_nuevos, INTERVALO_TABLERO_MS
 
 # Ejecutar la aplicación Dash
 if __name__ == '__main__':
+    # El refresco se inicia con el primer callback, así el proceso padre del reloader
+    # de debug=True no llama a las APIs
     app.run_server(debug=True)
+elif MODO_PRODUCCION:
+    # Importado por gunicorn: cada worker sincroniza el snapshot compartido aunque no reciba solicitudes
+    iniciar_refresco()
@@ -0,0 +1,140 @@
+# alert_dispatcher.py
+
+# Despachador de alertas por mail con una conexión SMTP persistente
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+
+class DespachadorAlertas:
+    """
+    Agrupa alertas en digests por destinatario, descarta duplicadas y las envía
+    desde un hilo en segundo plano reutilizando una única conexión SMTP autenticada.
+    Entre dos envíos se respeta un intervalo mínimo (intervalo_envio segundos).
+    """
+
+    def __init__(self, email_settings, ventana=5.0, intervalo_envio=1.0):
+        self.from_email = email_settings['from_email']
+        self.from_password = email_settings.get('from_password')
+        self.to_email = email_settings['to_email']
+        # Ruteo opcional por ciudad: {"Buenos Aires": "ops-ba@empresa.com", ...}
+        self.rutas = email_settings.get('routes', {})
+        self.host = email_settings.get('smtp_host', 'smtp.gmail.com')
+        self.port = email_settings.get('smtp_port', 587)
+        self.usar_tls = email_settings.get('use_tls', True)
+        self.ventana = ventana
+        self.intervalo_envio = intervalo_envio
+
+        self.enviados = 0
+        self.fallidos = 0
+        self._cola = queue.Queue()
+        self._server = None
+        self._ultimo_envio = 0.0
+        self._hilo = threading.Thread(target=self._procesar, name='despachador-alertas', daemon=True)
+        self._hilo.start()
+
+    def _destinatario(self, alert):
+        # Las alertas tienen la forma "<tipo> alert! <ciudad> at ...", se rutea por ciudad
+        for city_name, destinatario in self.rutas.items():
+            if f"! {city_name} at " in alert:
+                return destinatario
+        return self.to_email
+
+    def encolar(self, alerts):
+        # No bloquea: las alertas se envían desde el hilo del despachador
+        for alert in alerts:
+            self._cola.put((self._destinatario(alert), alert))
+
+    def cerrar(self, timeout=None):
+        # Se envía lo pendiente y se cierra la conexión SMTP
+        self._cola.put(None)
+        self._hilo.join(timeout)
+
+    def _conectar(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.usar_tls:
+            server.starttls()
+        if self.from_password:
+            server.login(self.from_email, self.from_password)
+        return server
+
+    def _desconectar(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def _procesar(self):
+        terminar = False
+        while not terminar:
+            pendientes = {}
+            # Se espera la primera alerta y se junta todo lo que llegue dentro de la ventana
+            item = self._cola.get()
+            limite = time.monotonic() + self.ventana
+            while True:
+                if item is None:
+                    terminar = True
+                    break
+                destinatario, alert = item
+                # dict conserva el orden de llegada y descarta alertas repetidas
+                pendientes.setdefault(destinatario, {})[alert] = None
+                restante = limite - time.monotonic()
+                try:
+                    item = self._cola.get(timeout=max(restante, 0)) if restante > 0 else self._cola.get_nowait()
+                except queue.Empty:
+                    break
+
+            for destinatario, alerts in pendientes.items():
+                try:
+                    self._enviar_digest(destinatario, list(alerts))
+                except Exception:
+                    # Un error no previsto no termina el hilo: el digest cuenta como fallido
+                    logging.error("Error inesperado al enviar el digest a %s", destinatario, exc_info=True)
+                    self.fallidos += 1
+                    self._desconectar()
+
+        self._desconectar()
+
+    def _enviar_digest(self, destinatario, alerts):
+        subject = "Weather Alert"
+        body = "The following cities have temperatures alerts:\n\n"
+        body += "".join(f"{alert}\n" for alert in alerts)
+
+        msg = MIMEMultipart()
+        msg['From'] = self.from_email
+        msg['To'] = destinatario
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+
+        # Límite de tasa entre envíos consecutivos
+        espera = self._ultimo_envio + self.intervalo_envio - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+
+        # Si la conexión se cayó se reconecta una vez y se reintenta
+        for intento in range(2):
+            try:
+                if self._server is None:
+                    self._server = self._conectar()
+                self._server.sendmail(self.from_email, destinatario, msg.as_string())
+                self._ultimo_envio = time.monotonic()
+                self.enviados += 1
+                logging.info(f"Digest con {len(alerts)} alertas enviado a {destinatario}")
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                logging.warning(f"Conexión SMTP perdida, reintentando: {e}")
+                self._server = None
+            except smtplib.SMTPException as e:
+                logging.error(f"Failed to send email: {str(e)}")
+                break
+            except OSError as e:
+                logging.warning(f"Error de red en SMTP, reintentando: {e}")
+                self._server = None
+        self.fallidos += 1
@@ -0,0 +1,89 @@
+# benchmark_snapshot.py
+
+# Benchmark de carga en frío de la última data válida: CSV anterior vs snapshot binario
+# Uso: python benchmark_snapshot.py --equipos 50 500 5000 --repeticiones 5
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from snapshot_store import guardar_snapshot, cargar_snapshot, cargar_csv_legado
+
+# Función para generar registros con la misma forma que la API NTR y la de Kalmar
+
+def generar_datos(n_equipos, seed=0):
+    rnd = random.Random(seed)
+    prefijos = ['FL ', 'RS ', 'RTG', 'GR']
+    ntr_data = [
+        {
+            'alias': f"{rnd.choice(prefijos)}{i:02d}",
+            'gps': {'lat': rnd.uniform(-35, -34), 'lon': rnd.uniform(-59, -58), 'velocidad': rnd.randint(0, 30)},
+            'entradas': {f'entrada{j}': rnd.randint(0, 1) for j in range(4)},
+            'totalizadores': {'horometro': rnd.uniform(0, 50000), 'odometro': rnd.uniform(0, 100000)},
+        }
+        for i in range(n_equipos)
+    ]
+    data2 = [
+        {'Alias': f"RS{i}", 'Horometro': float(rnd.randint(0, 40000)), 'Fecha': '01-01-2024'}
+        for i in range(max(1, n_equipos // 10))
+    ]
+    return ntr_data, data2
+
+# Escritura con el formato CSV anterior (igual que la versión original de actualizar_ultima_data_valida)
+
+def guardar_csv_legado(ntr_data, data2, archivo_ntr_csv, archivo_data2_csv):
+    df_ntr = pd.DataFrame(ntr_data)
+    for columna in ('gps', 'entradas', 'totalizadores'):
+        df_ntr[columna] = df_ntr[columna].apply(json.dumps)
+    df_ntr['last_update_time'] = '01-01-2024 00:00:00'
+    df_ntr.to_csv(archivo_ntr_csv, index=False)
+    pd.DataFrame(data2).to_csv(archivo_data2_csv, index=False)
+
+def medir(funcion, repeticiones, *args):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+def benchmark(equipos, repeticiones):
+    resultados = []
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo_ntr = os.path.join(directorio, 'Last_ntr_data.csv')
+        archivo_data2 = os.path.join(directorio, 'Last_data2.csv')
+        archivo_snapshot = os.path.join(directorio, 'last_valid_data.pkl')
+
+        for n in equipos:
+            ntr_data, data2 = generar_datos(n)
+            guardar_csv_legado(ntr_data, data2, archivo_ntr, archivo_data2)
+            guardar_snapshot(ntr_data, data2, '01-01-2024 00:00:00', archivo_snapshot)
+
+            # Se verifica que el snapshot devuelva exactamente los mismos campos anidados
+            assert cargar_snapshot(archivo_snapshot)['ntr_data'] == ntr_data
+
+            csv_s = medir(cargar_csv_legado, repeticiones, archivo_ntr, archivo_data2)
+            snapshot_s = medir(cargar_snapshot, repeticiones, archivo_snapshot)
+            resultados.append({
+                'equipos': n,
+                'csv_s': csv_s,
+                'snapshot_s': snapshot_s,
+                'csv_bytes': os.path.getsize(archivo_ntr) + os.path.getsize(archivo_data2),
+                'snapshot_bytes': os.path.getsize(archivo_snapshot),
+                'speedup': csv_s / snapshot_s if snapshot_s else None,
+            })
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark de carga de la última data válida')
+    parser.add_argument('--equipos', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    for resultado in benchmark(args.equipos, args.repeticiones):
+        print(json.dumps(resultado))
@@ -0,0 +1,67 @@
+# benchmark_startup.py
+
+# Benchmark de arranque en frío del tablero: tiempo de importación del módulo de la app,
+# módulos pesados cargados al importar y tiempo hasta la primera respuesta del servidor
+# Cada medición corre en un proceso nuevo para no reutilizar módulos ya importados
+# Uso: python benchmark_startup.py --repeticiones 5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+MODULO_APP = os.path.join(DIRECTORIO, 'Api_Pull_Request+DashApp.py')
+MODULOS_PESADOS = ['pandas', 'numpy', 'openpyxl', 'requests', 'win32com']
+
+# Script que se ejecuta en el proceso hijo; imprime un JSON con las mediciones
+SCRIPT_HIJO = r'''
+import importlib.util, json, os, sys, time
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+inicio = time.perf_counter()
+spec = importlib.util.spec_from_file_location('tablero', sys.argv[1])
+modulo = importlib.util.module_from_spec(spec)
+sys.modules['tablero'] = modulo
+spec.loader.exec_module(modulo)
+importado = time.perf_counter()
+cliente = modulo.server.test_client()
+respuesta = cliente.get('/')
+primera_respuesta = time.perf_counter()
+print(json.dumps({
+    'import_s': importado - inicio,
+    'primera_respuesta_s': primera_respuesta - inicio,
+    'status': respuesta.status_code,
+    'modulos': [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+'''
+
+def medir_arranque(directorio_trabajo):
+    salida = subprocess.run(
+        [sys.executable, '-c', SCRIPT_HIJO, MODULO_APP, json.dumps(MODULOS_PESADOS)],
+        cwd=directorio_trabajo, capture_output=True, text=True, check=True,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+def benchmark(repeticiones):
+    # Se ejecuta en un directorio vacío: el arranque no debe depender de archivos de datos
+    with tempfile.TemporaryDirectory() as directorio:
+        mediciones = [medir_arranque(directorio) for _ in range(repeticiones)]
+    return {
+        'repeticiones': repeticiones,
+        'import_s_min': min(m['import_s'] for m in mediciones),
+        'import_s_mediana': statistics.median(m['import_s'] for m in mediciones),
+        'primera_respuesta_s_min': min(m['primera_respuesta_s'] for m in mediciones),
+        'primera_respuesta_s_mediana': statistics.median(m['primera_respuesta_s'] for m in mediciones),
+        'status': mediciones[-1]['status'],
+        'modulos_pesados_al_importar': mediciones[-1]['modulos'],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark de arranque en frío del tablero de horómetros')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.repeticiones)))
@@ -0,0 +1,228 @@
+# benchmark_weather_etl.py
+
+# Benchmark offline de las etapas del ETL del clima con datos sintéticos
+# Uso: python benchmark_weather_etl.py parser --puntos 24 1000 100000 --repeticiones 5
+#      python benchmark_weather_etl.py etl --ciudades 10 100 1000 [--dsn "dbname=bench user=postgres"]
+# Cada resultado se imprime como una línea JSON (y se agrega a --salida si se indica)
+
+import argparse
+import json
+import random
+import threading
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import weather_script
+from weather_script import (
+    procesar_datos_clima, descargar_datos_clima, crear_sesion_http,
+    check_temperature_alerts, cargar_en_redshift, cargar_en_redshift_copy,
+)
+
+DIRECCIONES = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+TIPOS_PRECIPITACION = ['none', 'rain', 'snow']
+
+# Función para generar un payload sintético con la misma forma que astro.php
+
+def generar_payload(n_puntos, init='2024061212', seed=0):
+    rnd = random.Random(seed)
+    dataseries = [
+        {
+            'timepoint': 3 * (i + 1),
+            'cloudcover': rnd.randint(1, 9),
+            'seeing': rnd.randint(1, 8),
+            'transparency': rnd.randint(1, 8),
+            'lifted_index': rnd.choice([-10, -6, -4, -1, 2, 6, 10, 15]),
+            'rh2m': rnd.randint(-4, 16),
+            'wind10m': {'direction': rnd.choice(DIRECCIONES), 'speed': rnd.randint(1, 8)},
+            'temp2m': rnd.randint(-10, 40),
+            'prec_type': rnd.choice(TIPOS_PRECIPITACION),
+        }
+        for i in range(n_puntos)
+    ]
+    return {'product': 'astro', 'init': init, 'dataseries': dataseries}
+
+# Implementación original de get_weather_data (sin la descarga), como referencia
+
+def procesar_datos_clima_original(data, city_name):
+    df = pd.DataFrame(data['dataseries'])
+    wind_data = pd.json_normalize(df['wind10m'])
+    wind_data.columns = ['wind_direction', 'wind_speed']
+    df.drop(columns=['wind10m'], inplace=True)
+    df = pd.concat([df, wind_data], axis=1)
+    df['timestamp'] = pd.to_datetime(data['init'], format='%Y%m%d%H')
+    df['city_name'] = city_name
+    df['unique_id'] = df['timestamp'].astype(str) + '_' + df['timepoint'].astype(str) + '_' + df['city_name']
+    return df
+
+# Función para medir el mejor tiempo de varias repeticiones
+
+def medir(funcion, repeticiones, *args):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+def benchmark_parser(puntos, repeticiones):
+    resultados = []
+    for n in puntos:
+        payload = generar_payload(n)
+
+        # Se verifica que ambos parsers produzcan el mismo contenido
+        esperado = procesar_datos_clima_original(payload, 'Buenos Aires')
+        obtenido = procesar_datos_clima(payload, 'Buenos Aires')
+        obtenido['city_name'] = obtenido['city_name'].astype(esperado['city_name'].dtype)
+        pd.testing.assert_frame_equal(esperado, obtenido)
+
+        original = medir(procesar_datos_clima_original, repeticiones, payload, 'Buenos Aires')
+        nuevo = medir(procesar_datos_clima, repeticiones, payload, 'Buenos Aires')
+        resultados.append({
+            'etapa': 'parse',
+            'puntos': n,
+            'original_s': original,
+            'directo_s': nuevo,
+            'speedup': original / nuevo if nuevo else None,
+        })
+    return resultados
+
+# Servidor HTTP local que imita astro.php devolviendo payloads sintéticos
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que la sesión del cliente pueda reutilizar conexiones keep-alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    puntos = 64
+    latencia = 0.0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        # La semilla depende de las coordenadas para que cada ciudad tenga datos distintos
+        # (crc32 y no hash(): el hash de str cambia entre procesos y las corridas no serían comparables)
+        seed = zlib.crc32(f"{query.get('lon', [''])[0]}|{query.get('lat', [''])[0]}".encode('utf-8')) & 0xFFFF
+        cuerpo = json.dumps(generar_payload(self.puntos, seed=seed)).encode('utf-8')
+        if self.latencia:
+            time.sleep(self.latencia)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+def iniciar_stub(puntos, latencia):
+    handler = type('Handler', (StubHandler,), {'puntos': puntos, 'latencia': latencia})
+    # Cola de conexiones amplia para que las descargas concurrentes no pierdan SYNs
+    server_class = type('StubServer', (ThreadingHTTPServer,), {'request_queue_size': 1024, 'daemon_threads': True})
+    server = server_class(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def generar_ciudades(n):
+    rnd = random.Random(n)
+    return [
+        {'name': f'Ciudad {i}', 'lon': round(rnd.uniform(-180, 180), 3), 'lat': round(rnd.uniform(-60, 60), 3)}
+        for i in range(n)
+    ]
+
+# Función que mide cada etapa por separado para una cantidad de ciudades
+
+def benchmark_etl(n_ciudades, puntos, concurrencia, latencia, dsn=None):
+    resultados = []
+    ciudades = generar_ciudades(n_ciudades)
+    base = {'ciudades': n_ciudades, 'puntos': puntos}
+
+    server = iniciar_stub(puntos, latencia)
+    weather_script.URL_7TIMER = f"http://127.0.0.1:{server.server_address[1]}/bin/astro.php"
+    try:
+        # Descarga secuencial y concurrente (solo red + JSON)
+        session = crear_sesion_http(max_conexiones=concurrencia)
+        inicio = time.perf_counter()
+        payloads = [descargar_datos_clima(c['lon'], c['lat'], session=session, timeout=30) for c in ciudades]
+        resultados.append(dict(base, etapa='fetch_secuencial', segundos=time.perf_counter() - inicio))
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+            list(executor.map(lambda c: descargar_datos_clima(c['lon'], c['lat'], session=session, timeout=30), ciudades))
+        resultados.append(dict(base, etapa='fetch_concurrente', concurrencia=concurrencia, segundos=time.perf_counter() - inicio))
+        session.close()
+    finally:
+        server.shutdown()
+
+    # Parseo de los payloads a DataFrames
+    inicio = time.perf_counter()
+    frames = [procesar_datos_clima(p, c['name']) for p, c in zip(payloads, ciudades)]
+    df = pd.concat(frames, ignore_index=True).dropna()
+    resultados.append(dict(base, etapa='parse', filas=len(df), segundos=time.perf_counter() - inicio))
+
+    # Chequeo de alertas
+    inicio = time.perf_counter()
+    alerts = check_temperature_alerts(df, {'max_temp': 30, 'min_temp': 0}, {'wind_speed': {'max': 6}})
+    resultados.append(dict(base, etapa='alerts', alertas=len(alerts), segundos=time.perf_counter() - inicio))
+
+    # Carga en una base PostgreSQL local (opcional)
+    if dsn:
+        import psycopg2
+        conn = psycopg2.connect(dsn)
+        try:
+            for etapa, cargar in [('load_insert', cargar_en_redshift), ('load_copy_upsert', cargar_en_redshift_copy)]:
+                with conn.cursor() as cur:
+                    cur.execute("DROP TABLE IF EXISTS benchmark_temperatura")
+                conn.commit()
+                inicio = time.perf_counter()
+                cargado = cargar(conn, 'benchmark_temperatura', df)
+                segundos = time.perf_counter() - inicio
+                # Los loaders capturan sus errores y devuelven False: una carga fallida no se mide
+                if not cargado:
+                    print(f"La etapa {etapa} falló; se omite del resultado", file=sys.stderr)
+                    continue
+                resultados.append(dict(base, etapa=etapa, filas=len(df), segundos=segundos))
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS benchmark_temperatura")
+            conn.commit()
+        finally:
+            conn.close()
+
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark offline del ETL del clima')
+    comunes = argparse.ArgumentParser(add_help=False)
+    comunes.add_argument('--salida', help='Archivo JSON Lines donde agregar los resultados')
+    subparsers = parser.add_subparsers(dest='modo', required=True)
+
+    parser_parser = subparsers.add_parser('parser', parents=[comunes], help='Compara el parser directo con el original')
+    parser_parser.add_argument('--puntos', type=int, nargs='+', default=[24, 1000, 100000])
+    parser_parser.add_argument('--repeticiones', type=int, default=5)
+
+    parser_etl = subparsers.add_parser('etl', parents=[comunes], help='Mide fetch, parse, alertas y carga por separado')
+    parser_etl.add_argument('--ciudades', type=int, nargs='+', default=[10, 100, 1000])
+    parser_etl.add_argument('--puntos', type=int, default=64)
+    parser_etl.add_argument('--concurrencia', type=int, default=16)
+    parser_etl.add_argument('--latencia', type=float, default=0.05, help='Latencia simulada por respuesta (segundos)')
+    parser_etl.add_argument('--dsn', help='DSN de un PostgreSQL local para medir la carga')
+    args = parser.parse_args()
+
+    if args.modo == 'parser':
+        resultados = benchmark_parser(args.puntos, args.repeticiones)
+    else:
+        resultados = []
+        for n in args.ciudades:
+            resultados.extend(benchmark_etl(n, args.puntos, args.concurrencia, args.latencia, args.dsn))
+
+    for resultado in resultados:
+        resultado['fecha'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        print(json.dumps(resultado))
+
+    if args.salida:
+        with open(args.salida, 'a') as f:
+            for resultado in resultados:
+                f.write(json.dumps(resultado) + '\n')
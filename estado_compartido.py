@@ -0,0 +1,88 @@
+# estado_compartido.py
+
+# Estado compartido entre procesos (workers de gunicorn) sobre un archivo SQLite local
+# SQLite serializa las escrituras con su propio lock de archivo, así que todos los
+# workers ven el mismo estado de rate-limit, la misma versión de snapshot y un único líder
+
+import json
+import sqlite3
+import time
+
+ARCHIVO_ESTADO = 'estado_compartido.sqlite'
+
+
+class EstadoCompartido:
+    """
+    Pares clave/valor (JSON) y liderazgos con vencimiento compartidos entre procesos.
+    """
+
+    def __init__(self, ruta=ARCHIVO_ESTADO):
+        self.ruta = ruta
+        self._inicializado = False
+
+    def _conectar(self):
+        # isolation_level=None: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        # Las tablas se crean en la primera conexión y no al importar el módulo
+        if not self._inicializado:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor TEXT, actualizado REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS liderazgo (nombre TEXT PRIMARY KEY, worker TEXT, vence REAL)")
+            self._inicializado = True
+        return conn
+
+    def leer(self, clave, defecto=None):
+        conn = self._conectar()
+        try:
+            fila = conn.execute("SELECT valor FROM estado WHERE clave = ?", (clave,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(fila[0]) if fila else defecto
+
+    def leer_prefijo(self, prefijo, max_antiguedad=None):
+        # {clave: valor} de las claves que empiezan con 'prefijo', opcionalmente solo las
+        # escritas en los últimos 'max_antiguedad' segundos
+        desde = time.time() - max_antiguedad if max_antiguedad is not None else 0
+        conn = self._conectar()
+        try:
+            filas = conn.execute(
+                "SELECT clave, valor FROM estado WHERE substr(clave, 1, ?) = ? AND actualizado >= ?",
+                (len(prefijo), prefijo, desde),
+            ).fetchall()
+        finally:
+            conn.close()
+        return {clave: json.loads(valor) for clave, valor in filas}
+
+    def escribir(self, clave, valor):
+        conn = self._conectar()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO estado (clave, valor, actualizado) VALUES (?, ?, ?)",
+                (clave, json.dumps(valor), time.time()),
+            )
+        finally:
+            conn.close()
+
+    def tomar_liderazgo(self, nombre, worker_id, ttl):
+        # Devuelve True si worker_id es (o pasa a ser) el líder; el liderazgo se renueva
+        # en cada llamada y otro worker solo puede tomarlo cuando vence
+        ahora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            fila = conn.execute("SELECT worker, vence FROM liderazgo WHERE nombre = ?", (nombre,)).fetchone()
+            if fila is None or fila[0] == worker_id or fila[1] < ahora:
+                conn.execute(
+                    "INSERT OR REPLACE INTO liderazgo (nombre, worker, vence) VALUES (?, ?, ?)",
+                    (nombre, worker_id, ahora + ttl),
+                )
+                conn.execute("COMMIT")
+                return True
+            conn.execute("COMMIT")
+            return False
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
@@ -0,0 +1,124 @@
+# horometro_history.py
+
+# Historial de lecturas de horómetros en SQLite, indexado por (alias, ts)
+
+import logging
+import sqlite3
+import threading
+import time
+
+ARCHIVO_HISTORIAL = 'horometros_historial.sqlite'
+UN_DIA = 86400
+
+
+class HistorialHorometros:
+    """
+    Guarda cada lectura Alias/Horometro en una tabla con clave primaria (alias, ts),
+    de modo que las consultas por alias y rango de tiempo usan el índice.
+    Las lecturas viejas se compactan a una por alias y día y se borran al superar la retención.
+    """
+
+    def __init__(self, ruta=ARCHIVO_HISTORIAL, retencion_dias=730, compactar_despues_dias=30):
+        self.ruta = ruta
+        self.retencion_dias = retencion_dias
+        self.compactar_despues_dias = compactar_despues_dias
+        self._ultimo_mantenimiento = 0
+        self._lock = threading.Lock()
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lecturas (
+                    alias TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    horometro REAL,
+                    PRIMARY KEY (alias, ts)
+                ) WITHOUT ROWID
+            """)
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def agregar_lecturas(self, lecturas, ts=None):
+        # lecturas: iterable de (alias, horometro); todas con el mismo timestamp
+        ts = time.time() if ts is None else ts
+        filas = [(alias, ts, float(horometro)) for alias, horometro in lecturas]
+        with self._lock, self._conectar() as conn:
+            conn.executemany("INSERT OR REPLACE INTO lecturas (alias, ts, horometro) VALUES (?, ?, ?)", filas)
+        return len(filas)
+
+    def consultar_rango(self, alias, desde, hasta):
+        with self._conectar() as conn:
+            return conn.execute(
+                "SELECT ts, horometro FROM lecturas WHERE alias = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (alias, desde, hasta),
+            ).fetchall()
+
+    def consultar_flota(self, desde, hasta, resolucion=UN_DIA):
+        # Tendencia de toda la flota: última lectura de cada alias por intervalo de 'resolucion' segundos
+        with self._conectar() as conn:
+            return conn.execute(
+                """
+                SELECT alias, CAST(ts / ? AS INTEGER) * ? AS intervalo, horometro, MAX(ts)
+                FROM lecturas
+                WHERE ts >= ? AND ts < ?
+                GROUP BY alias, intervalo
+                ORDER BY alias, intervalo
+                """,
+                (resolucion, resolucion, desde, hasta),
+            ).fetchall()
+
+    def lectura_anterior(self, alias, hasta):
+        # Última lectura del alias en o antes de 'hasta' (búsqueda por índice)
+        with self._conectar() as conn:
+            return conn.execute(
+                "SELECT ts, horometro FROM lecturas WHERE alias = ? AND ts <= ? ORDER BY ts DESC LIMIT 1",
+                (alias, hasta),
+            ).fetchone()
+
+    def diferencias_periodo(self, desde, hasta):
+        # Horas de uso de cada alias entre 'desde' y 'hasta', para consultas de tendencia.
+        # La comparación semanal del tablero (comparar_horometros_semanales) no la usa:
+        # sigue tomando la línea base de horometros_anteriores.csv
+        with self._conectar() as conn:
+            return conn.execute(
+                """
+                SELECT a.alias,
+                       (SELECT horometro FROM lecturas WHERE alias = a.alias AND ts <= ? ORDER BY ts DESC LIMIT 1)
+                     - (SELECT horometro FROM lecturas WHERE alias = a.alias AND ts <= ? ORDER BY ts DESC LIMIT 1)
+                FROM (SELECT DISTINCT alias FROM lecturas) AS a
+                """,
+                (hasta, desde),
+            ).fetchall()
+
+    def compactar(self, antes_de, resolucion=UN_DIA):
+        # Se conserva solo la última lectura de cada alias por intervalo para datos anteriores a 'antes_de'
+        with self._lock, self._conectar() as conn:
+            cursor = conn.execute(
+                """
+                DELETE FROM lecturas
+                WHERE ts < ?
+                  AND (alias, ts) NOT IN (
+                      SELECT alias, MAX(ts) FROM lecturas
+                      WHERE ts < ?
+                      GROUP BY alias, CAST(ts / ? AS INTEGER)
+                  )
+                """,
+                (antes_de, antes_de, resolucion),
+            )
+            return cursor.rowcount
+
+    def aplicar_retencion(self, ahora=None):
+        ahora = time.time() if ahora is None else ahora
+        with self._lock, self._conectar() as conn:
+            cursor = conn.execute("DELETE FROM lecturas WHERE ts < ?", (ahora - self.retencion_dias * UN_DIA,))
+            return cursor.rowcount
+
+    def mantener_si_corresponde(self, ahora=None):
+        # Compactación y retención como mucho una vez por día
+        ahora = time.time() if ahora is None else ahora
+        if ahora - self._ultimo_mantenimiento < UN_DIA:
+            return
+        self._ultimo_mantenimiento = ahora
+        compactadas = self.compactar(ahora - self.compactar_despues_dias * UN_DIA)
+        borradas = self.aplicar_retencion(ahora)
+        logging.info(f"Historial de horómetros: {compactadas} lecturas compactadas, {borradas} fuera de retención")
@@ -0,0 +1,86 @@
+# logging_setup.py
+
+# Logging sin bloqueo: los hilos de la app solo encolan el registro (QueueHandler) y un
+# hilo aparte (QueueListener) lo formatea y lo escribe en un archivo con rotación por tamaño
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import reprlib
+
+FORMATO = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """
+    QueueHandler que encola el registro tal cual: el mensaje ('%' con sus argumentos) y el
+    traceback se formatean en el hilo del listener y no en el hilo que llamó al logger.
+    Los argumentos no deben modificarse después de loguearlos (todo ocurre en el mismo proceso).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configurar_logging(archivo='logfile.log', nivel=logging.DEBUG, max_bytes=10 * 1024 * 1024, respaldos=5):
+    """
+    Configura el logger raíz con un QueueHandler y devuelve el QueueListener que escribe
+    en 'archivo' (rota al superar max_bytes y conserva 'respaldos' archivos anteriores).
+    Llamadas repetidas devuelven el mismo listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    # delay=True: el archivo se abre con el primer registro, no al configurar
+    manejador_archivo = logging.handlers.RotatingFileHandler(
+        archivo, maxBytes=max_bytes, backupCount=respaldos, encoding='utf-8', delay=True,
+    )
+    manejador_archivo.setFormatter(logging.Formatter(FORMATO))
+
+    cola = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    raiz.setLevel(nivel)
+    raiz.addHandler(ManejadorCola(cola))
+
+    _listener = logging.handlers.QueueListener(cola, manejador_archivo, respect_handler_level=True)
+    _listener.start()
+    # Al cerrar el proceso se vacía la cola antes de salir
+    atexit.register(detener_logging)
+    return _listener
+
+
+def detener_logging():
+    # Escribe los registros pendientes y detiene el hilo del listener
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class Resumen:
+    """
+    Envuelve un objeto grande para pasarlo como argumento de logging ('%s'): el texto se
+    arma solo si el mensaje se emite y con reprlib, que recorre únicamente los primeros
+    elementos de cada colección, así que el costo no crece con el tamaño del payload.
+    """
+
+    def __init__(self, objeto, max_elementos=3, max_largo=200):
+        self.objeto = objeto
+        self._repr = reprlib.Repr()
+        self._repr.maxlevel = 2
+        self._repr.maxlist = self._repr.maxtuple = self._repr.maxdict = self._repr.maxset = max_elementos
+        self._repr.maxstring = self._repr.maxother = max_largo
+
+    def __str__(self):
+        objeto = self.objeto
+        if isinstance(objeto, (list, tuple, dict, set)):
+            prefijo = f"<{type(objeto).__name__} de {len(objeto)} elementos> "
+        elif hasattr(objeto, 'shape'):
+            prefijo = f"<{type(objeto).__name__} {objeto.shape}> "
+        else:
+            prefijo = ''
+        return prefijo + self._repr.repr(objeto)
@@ -0,0 +1,124 @@
+# metrics.py
+
+# Capa liviana de tiempos y contadores por etapa (llamadas a APIs, parseo, comparación
+# semanal, exportación a Excel, carga en Redshift, chequeo de alertas)
+# Los valores se acumulan en memoria del proceso y se exponen en formato de texto de Prometheus
+
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIJO = 'horometros_'
+
+
+class RegistroMetricas:
+    """
+    Acumula, por etapa, cantidad de ejecuciones, segundos totales, último y máximo,
+    y contadores libres. Es seguro para usar desde varios hilos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiempos = {}
+        self._contadores = {}
+
+    @contextmanager
+    def medir(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.incrementar(f'{etapa}_errores')
+            raise
+        finally:
+            self.registrar_tiempo(etapa, time.perf_counter() - inicio)
+
+    def registrar_tiempo(self, etapa, segundos):
+        with self._lock:
+            cantidad, total, _, maximo = self._tiempos.get(etapa, (0, 0.0, 0.0, 0.0))
+            self._tiempos[etapa] = (cantidad + 1, total + segundos, segundos, max(maximo, segundos))
+
+    def incrementar(self, nombre, valor=1):
+        with self._lock:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + valor
+
+    def resumen(self):
+        # Copia de los valores actuales: {'tiempos': {etapa: {...}}, 'contadores': {...}}
+        with self._lock:
+            tiempos = {
+                etapa: {'cantidad': cantidad, 'total_s': round(total, 6), 'ultimo_s': round(ultimo, 6), 'max_s': round(maximo, 6)}
+                for etapa, (cantidad, total, ultimo, maximo) in self._tiempos.items()
+            }
+            return {'tiempos': tiempos, 'contadores': dict(self._contadores)}
+
+    def reiniciar(self):
+        with self._lock:
+            self._tiempos.clear()
+            self._contadores.clear()
+
+    def formato_prometheus(self, etiquetas=None):
+        # 'etiquetas' se agregan a todas las series (p. ej. {'worker': ...})
+        return formato_prometheus_combinado([(etiquetas or {}, self.resumen())])
+
+    def registrar_resumen(self, titulo, reiniciar=False):
+        # Deja en el log una línea con los tiempos de la corrida (se usa desde las tareas de Airflow)
+        resumen = self.resumen()
+        partes = [f"{etapa}={valores['total_s']:.3f}s/{valores['cantidad']}" for etapa, valores in sorted(resumen['tiempos'].items())]
+        partes += [f"{contador}={valor}" for contador, valor in sorted(resumen['contadores'].items())]
+        logging.info("Tiempos %s: %s", titulo, ' '.join(partes) or 'sin mediciones')
+        if reiniciar:
+            self.reiniciar()
+        return resumen
+
+
+def _nombre_valido(nombre):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', nombre)
+
+
+def _etiquetas(pares):
+    return '{' + ','.join(f'{clave}="{valor}"' for clave, valor in pares) + '}' if pares else ''
+
+
+def formato_prometheus_combinado(resumenes):
+    """
+    Texto de Prometheus a partir de una lista de (etiquetas, resumen()) de uno o varios
+    procesos: cada métrica lleva su HELP/TYPE una sola vez y una serie por proceso y etapa.
+    """
+    lineas = []
+
+    nombre = f'{PREFIJO}etapa_segundos'
+    lineas.append(f'# HELP {nombre} Duración de cada etapa en segundos')
+    lineas.append(f'# TYPE {nombre} summary')
+    for etiquetas, resumen in resumenes:
+        for etapa, valores in sorted(resumen['tiempos'].items()):
+            serie = _etiquetas([('etapa', etapa), *etiquetas.items()])
+            lineas.append(f'{nombre}_count{serie} {valores["cantidad"]}')
+            lineas.append(f'{nombre}_sum{serie} {valores["total_s"]:.6f}')
+
+    for campo, clave, ayuda in (('ultimo', 'ultimo_s', 'Duración de la última ejecución'), ('max', 'max_s', 'Duración máxima observada')):
+        nombre = f'{PREFIJO}etapa_{campo}_segundos'
+        lineas.append(f'# HELP {nombre} {ayuda} de cada etapa en segundos')
+        lineas.append(f'# TYPE {nombre} gauge')
+        for etiquetas, resumen in resumenes:
+            for etapa, valores in sorted(resumen['tiempos'].items()):
+                lineas.append(f'{nombre}{_etiquetas([("etapa", etapa), *etiquetas.items()])} {valores[clave]:.6f}')
+
+    contadores = {}
+    for etiquetas, resumen in resumenes:
+        for contador, valor in resumen['contadores'].items():
+            contadores.setdefault(contador, []).append((etiquetas, valor))
+    for contador, valores in sorted(contadores.items()):
+        nombre = f'{PREFIJO}{_nombre_valido(contador)}_total'
+        lineas.append(f'# TYPE {nombre} counter')
+        for etiquetas, valor in valores:
+            lineas.append(f'{nombre}{_etiquetas(list(etiquetas.items()))} {valor}')
+
+    return '\n'.join(lineas) + '\n'
+
+
+# Registro por defecto del proceso
+registro = RegistroMetricas()
+medir = registro.medir
+incrementar = registro.incrementar
@@ -0,0 +1,162 @@
+# redshift_pool.py
+
+# Pool de conexiones reutilizables al warehouse (Redshift / PostgreSQL)
+#
+# El pool y la cache de credenciales viven en memoria del proceso. En Airflow cada tarea
+# (cada corrida de backfill y cada shard mapeado) es un proceso aparte, así que solo se
+# reutilizan conexiones dentro de una misma tarea (p. ej. los bloques del modo streaming);
+# el handshake por corrida no cambia. Para reutilizar conexiones entre corridas hay que
+# apuntar secret.json a un pooler externo (pgbouncer o RDS Proxy) en lugar del cluster
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+# Ruta por defecto del archivo con las credenciales
+SECRET_FILE_PATH = 'secret.json'
+
+# Credenciales cacheadas por ruta para no releer secret.json en cada conexión
+_credenciales_cache = {}
+_credenciales_lock = threading.Lock()
+
+# Función para leer (una sola vez) las credenciales del archivo secret.json
+
+def cargar_credenciales(secret_file_path=SECRET_FILE_PATH):
+    with _credenciales_lock:
+        if secret_file_path not in _credenciales_cache:
+            with open(secret_file_path) as f:
+                secreto = json.load(f)
+            _credenciales_cache[secret_file_path] = {
+                'dbname': secreto['dbname'],
+                'user': secreto['user'],
+                'password': secreto['password'],
+                'host': secreto['host'],
+                'port': secreto['port'],
+            }
+        return _credenciales_cache[secret_file_path]
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones psycopg2 con tamaño máximo, chequeo de salud al prestar
+    y descarte de conexiones ociosas por más de max_idle segundos.
+    """
+
+    def __init__(self, credenciales, max_size=5, max_idle=300, timeout=30):
+        self.credenciales = credenciales
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._libres = []  # Lista de (conexión, momento en que se devolvió)
+        self._en_uso = 0
+        self._cond = threading.Condition()
+
+    def _abrir(self):
+        conn = psycopg2.connect(**self.credenciales)
+        logging.info("Nueva conexión al warehouse abierta")
+        return conn
+
+    @staticmethod
+    def _esta_sana(conn):
+        # Se descarta la conexión si está cerrada o no responde a un SELECT 1
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _cerrar(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _descartar_ociosas(self):
+        ahora = time.monotonic()
+        vigentes = []
+        for conn, devuelta in self._libres:
+            if ahora - devuelta > self.max_idle:
+                self._cerrar(conn)
+            else:
+                vigentes.append((conn, devuelta))
+        self._libres = vigentes
+
+    def obtener(self):
+        limite = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                self._descartar_ociosas()
+                # Se reutiliza la conexión devuelta más recientemente
+                while self._libres:
+                    conn, _ = self._libres.pop()
+                    if self._esta_sana(conn):
+                        self._en_uso += 1
+                        return conn
+                    self._cerrar(conn)
+                if self._en_uso < self.max_size:
+                    self._en_uso += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise TimeoutError("No hay conexiones libres en el pool")
+                self._cond.wait(restante)
+
+        # La conexión nueva se abre fuera del lock para no bloquear al resto
+        try:
+            return self._abrir()
+        except Exception:
+            with self._cond:
+                self._en_uso -= 1
+                self._cond.notify()
+            raise
+
+    def devolver(self, conn):
+        with self._cond:
+            self._en_uso -= 1
+            if conn.closed:
+                self._cond.notify()
+                return
+            try:
+                # Se descarta cualquier transacción pendiente antes de reutilizarla
+                conn.rollback()
+                self._libres.append((conn, time.monotonic()))
+            except psycopg2.Error:
+                self._cerrar(conn)
+            self._cond.notify()
+
+    def cerrar_todo(self):
+        with self._cond:
+            for conn, _ in self._libres:
+                self._cerrar(conn)
+            self._libres = []
+
+    @contextmanager
+    def conexion(self):
+        conn = self.obtener()
+        try:
+            yield conn
+        finally:
+            self.devolver(conn)
+
+
+# Pool compartido por todo el proceso
+_pool = None
+_pool_lock = threading.Lock()
+
+# Función para obtener el pool compartido (se crea en el primer uso)
+
+def obtener_pool(secret_file_path=SECRET_FILE_PATH, **kwargs):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PoolConexiones(cargar_credenciales(secret_file_path), **kwargs)
+        return _pool
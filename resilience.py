@@ -0,0 +1,159 @@
+# resilience.py
+
+# Capa de resiliencia compartida para las llamadas HTTP a proveedores externos
+# (7timer, CAE NTR, Kalmar): circuit breaker por endpoint, reintentos con back-off
+# exponencial con jitter y un plazo total (deadline) que se propaga a cada intento
+
+import logging
+import random
+import threading
+import time
+
+from metrics import incrementar
+
+
+class CircuitoAbierto(Exception):
+    """El circuito del endpoint está abierto: no se intenta la llamada."""
+
+
+class PlazoAgotado(Exception):
+    """No queda tiempo del plazo total para otro intento."""
+
+
+class Plazo:
+    """
+    Plazo total (en segundos) de una operación. Cada intento usa como timeout
+    lo que quede del plazo, sin superar el timeout propio de la llamada.
+    """
+
+    def __init__(self, segundos):
+        self.limite = time.monotonic() + segundos if segundos is not None else None
+
+    def restante(self):
+        if self.limite is None:
+            return None
+        return max(0.0, self.limite - time.monotonic())
+
+    def vencido(self):
+        return self.limite is not None and time.monotonic() >= self.limite
+
+    def timeout(self, timeout=None):
+        # Acota un timeout de requests (número o tupla (conexión, lectura)) a lo que queda
+        restante = self.restante()
+        if restante is None:
+            return timeout
+        if restante <= 0:
+            raise PlazoAgotado("Se agotó el plazo total")
+        if timeout is None:
+            return restante
+        if isinstance(timeout, tuple):
+            return tuple(min(t, restante) for t in timeout)
+        return min(timeout, restante)
+
+
+class CircuitBreaker:
+    """
+    Se abre después de 'umbral_fallas' fallas consecutivas y rechaza las llamadas durante
+    'tiempo_apertura' segundos; luego deja pasar una llamada de prueba (semiabierto) y
+    se cierra si tiene éxito o vuelve a abrirse si falla.
+    """
+
+    def __init__(self, nombre, umbral_fallas=5, tiempo_apertura=60):
+        self.nombre = nombre
+        self.umbral_fallas = umbral_fallas
+        self.tiempo_apertura = tiempo_apertura
+        self.fallas = 0
+        self.abierto_desde = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado()
+
+    def _estado(self):
+        if self.abierto_desde is None:
+            return 'cerrado'
+        if time.monotonic() - self.abierto_desde >= self.tiempo_apertura:
+            return 'semiabierto'
+        return 'abierto'
+
+    def permitir(self):
+        with self._lock:
+            estado = self._estado()
+            if estado == 'cerrado':
+                return True
+            # En semiabierto pasa una sola llamada de prueba a la vez
+            if estado == 'semiabierto' and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            if self.abierto_desde is not None:
+                logging.info("Circuito %s cerrado", self.nombre)
+            self.fallas = 0
+            self.abierto_desde = None
+            self._prueba_en_curso = False
+
+    def registrar_falla(self):
+        with self._lock:
+            self.fallas += 1
+            # Se abre al llegar al umbral, o se reabre si falló la llamada de prueba
+            if self._prueba_en_curso or (self.abierto_desde is None and self.fallas >= self.umbral_fallas):
+                logging.warning("Circuito %s abierto por %s segundos tras %s fallas", self.nombre, self.tiempo_apertura, self.fallas)
+                incrementar(f'circuito_{self.nombre}_aperturas')
+                self.abierto_desde = time.monotonic()
+            self._prueba_en_curso = False
+
+    def liberar_prueba(self):
+        with self._lock:
+            self._prueba_en_curso = False
+
+
+# Un breaker por endpoint, compartido por todos los hilos del proceso
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def obtener_breaker(nombre, umbral_fallas=5, tiempo_apertura=60):
+    with _breakers_lock:
+        if nombre not in _breakers:
+            _breakers[nombre] = CircuitBreaker(nombre, umbral_fallas=umbral_fallas, tiempo_apertura=tiempo_apertura)
+        return _breakers[nombre]
+
+# Función para esperar entre intentos: back-off exponencial con jitter completo
+
+def espera_con_jitter(intento, base=0.5, maximo=10.0):
+    return random.uniform(0, min(maximo, base * (2 ** intento)))
+
+# Función para llamar a 'funcion(timeout)' con breaker, reintentos y plazo total
+# 'funcion' recibe el timeout a usar y debe lanzar una excepción si la llamada falló
+
+def llamar_con_reintentos(funcion, breaker, plazo=None, timeout=None, reintentos=2, base=0.5, maximo=10.0, errores=(Exception,)):
+    plazo = plazo if plazo is not None else Plazo(None)
+    for intento in range(reintentos + 1):
+        # Sin plazo restante se lanza PlazoAgotado antes de tocar el breaker
+        timeout_intento = plazo.timeout(timeout)
+        if not breaker.permitir():
+            incrementar(f'circuito_{breaker.nombre}_rechazos')
+            raise CircuitoAbierto(f"Circuito {breaker.nombre} abierto")
+        try:
+            resultado = funcion(timeout_intento)
+        except errores as e:
+            breaker.registrar_falla()
+            incrementar(f'circuito_{breaker.nombre}_fallas')
+            espera = espera_con_jitter(intento, base, maximo)
+            restante = plazo.restante()
+            if intento == reintentos or (restante is not None and espera >= restante):
+                raise
+            logging.warning("Falla en %s (intento %s/%s): %s; reintento en %.1f s", breaker.nombre, intento + 1, reintentos + 1, e, espera)
+            time.sleep(espera)
+        except BaseException:
+            # Un error que no cuenta como falla del endpoint solo libera la llamada de prueba
+            breaker.liberar_prueba()
+            raise
+        else:
+            breaker.registrar_exito()
+            return resultado
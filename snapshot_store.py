@@ -0,0 +1,94 @@
+# snapshot_store.py
+
+# Almacenamiento binario de la última data válida del tablero de horómetros
+# Se usa pickle (binario, incluido en Python) para conservar los campos anidados
+# (gps, entradas, totalizadores) con sus tipos, sin serializarlos como texto
+
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+ARCHIVO_SNAPSHOT = 'last_valid_data.pkl'
+VERSION_SNAPSHOT = 1
+
+# Función para guardar cualquier objeto con pickle de forma atómica (archivo temporal + rename)
+
+def guardar_pickle_atomico(objeto, ruta):
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    fd, tmp = tempfile.mkstemp(dir=directorio, prefix='.snapshot_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(objeto, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        # Un corte durante la escritura deja intacto el archivo anterior
+        os.replace(tmp, ruta)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+# Función para leer un archivo pickle; devuelve None si no existe o no se puede leer
+
+def cargar_pickle(ruta):
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, 'rb') as f:
+            return pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        logging.error(f"Snapshot {ruta} ilegible: {e}")
+        return None
+
+# Función para guardar el snapshot de la última data válida
+
+def guardar_snapshot(ntr_data, data2, last_update_time, ruta=ARCHIVO_SNAPSHOT):
+    guardar_pickle_atomico({
+        'version': VERSION_SNAPSHOT,
+        'ntr_data': ntr_data,
+        'data2': data2,
+        'last_update_time': last_update_time,
+    }, ruta)
+
+# Función para cargar el snapshot; devuelve None si no existe o no se puede leer
+
+def cargar_snapshot(ruta=ARCHIVO_SNAPSHOT):
+    snapshot = cargar_pickle(ruta)
+    if snapshot is None:
+        return None
+    if snapshot.get('version') != VERSION_SNAPSHOT:
+        logging.warning(f"Versión de snapshot no soportada en {ruta}: {snapshot.get('version')}")
+        return None
+    return snapshot
+
+def safe_json_loads(json_str):
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError as e:
+        logging.error(f"Error al decodificar JSON: {e}")
+        return {}
+    except Exception as e:
+        logging.error(f"Error desconocido: {e}")
+        return {}
+
+# Función para leer el formato anterior (Last_ntr_data.csv / Last_data2.csv)
+# Se mantiene para migrar instalaciones existentes y para el benchmark
+
+def cargar_csv_legado(archivo_ntr_csv='Last_ntr_data.csv', archivo_data2_csv='Last_data2.csv'):
+    import pandas as pd
+
+    # Leer los DataFrames desde los archivos CSV
+    df_ntr = pd.read_csv(archivo_ntr_csv)
+    df2 = pd.read_csv(archivo_data2_csv)
+
+    # Reemplazar comillas simples por comillas dobles, manejar NaN y deserializar columnas JSON
+    for columna in ('gps', 'entradas', 'totalizadores'):
+        df_ntr[columna] = df_ntr[columna].fillna('{}').str.replace("'", '"').apply(safe_json_loads)
+
+    last_update_time = None
+    if 'last_update_time' in df_ntr.columns:
+        last_update_time = df_ntr['last_update_time'].iloc[0]
+
+    return df_ntr.to_dict(orient='records'), df2.to_dict(orient='records'), last_update_time
@@ -0,0 +1,239 @@
+# watermark_index.py
+
+# Índice local de las claves ya cargadas en el warehouse, para que los backfills
+# (catchup=True) no reenvíen filas que ya existen. Por ciudad se guarda el mayor
+# 'timestamp' (init del pronóstico) cargado y, para todas las filas, un filtro de Bloom
+# de los unique_id. Si el archivo se pierde, el índice se reconstruye desde el warehouse
+
+import hashlib
+import logging
+import math
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+
+ARCHIVO_INDICE = 'indice_cargas.sqlite'
+
+# Formato fijo de las marcas de agua: astype(str) omite la hora cuando todos los valores
+# de la serie son de medianoche, y esas cadenas no se ordenan igual que las completas
+FORMATO_TIMESTAMP = '%Y-%m-%d %H:%M:%S'
+
+def formatear_timestamps(serie):
+    return pd.to_datetime(serie).dt.strftime(FORMATO_TIMESTAMP)
+
+
+class FiltroBloom:
+    """
+    Filtro de Bloom sobre un bytearray: 'contiene' puede dar falsos positivos
+    (con probabilidad ~error hasta 'capacidad' claves) pero nunca falsos negativos.
+    """
+
+    def __init__(self, m_bits, k, bits=None):
+        self.m_bits = m_bits
+        self.k = k
+        self.bits = bytearray(bits) if bits is not None else bytearray((m_bits + 7) // 8)
+
+    @classmethod
+    def para_capacidad(cls, capacidad, error=0.01):
+        m_bits = max(8, int(math.ceil(-capacidad * math.log(error) / (math.log(2) ** 2))))
+        k = max(1, int(round(m_bits / capacidad * math.log(2))))
+        return cls(m_bits, k)
+
+    def _posiciones(self, clave):
+        # Doble hashing: h1 + i*h2 a partir de un único blake2b de 16 bytes
+        digest = hashlib.blake2b(clave.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.m_bits for i in range(self.k)]
+
+    def agregar(self, clave):
+        for posicion in self._posiciones(clave):
+            self.bits[posicion >> 3] |= 1 << (posicion & 7)
+
+    def contiene(self, clave):
+        return all(self.bits[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(clave))
+
+    def unir(self, otro):
+        # OR bit a bit con otro filtro de las mismas dimensiones
+        bits = int.from_bytes(self.bits, 'little') | int.from_bytes(otro.bits, 'little')
+        self.bits = bytearray(bits.to_bytes(len(self.bits), 'little'))
+
+
+class IndiceCargas:
+    """
+    Marca de agua por ciudad (mayor 'timestamp' cargado) y filtro de Bloom de unique_id
+    persistidos en SQLite. Una fila con 'timestamp' posterior a la marca de su ciudad es
+    nueva; si no, se consulta el filtro y las posibles coincidencias se confirman contra
+    el warehouse, así un falso positivo nunca deja una fila sin cargar.
+    """
+
+    def __init__(self, ruta=ARCHIVO_INDICE, capacidad=2000000, error=0.01):
+        self.ruta = ruta
+        self.capacidad = capacidad
+        self.error = error
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS marcas (city_name TEXT PRIMARY KEY, max_timestamp TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS filtro (id INTEGER PRIMARY KEY CHECK (id = 1), m_bits INTEGER, k INTEGER, bits BLOB)")
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def _leer_filtro(self, conn):
+        fila = conn.execute("SELECT m_bits, k, bits FROM filtro WHERE id = 1").fetchone()
+        if fila is None:
+            return None
+        return FiltroBloom(fila[0], fila[1], fila[2])
+
+    def existe(self):
+        with self._conectar() as conn:
+            return self._leer_filtro(conn) is not None
+
+    def marcas(self):
+        with self._conectar() as conn:
+            return dict(conn.execute("SELECT city_name, max_timestamp FROM marcas").fetchall())
+
+    def registrar(self, dataframe):
+        # Agrega las claves de filas ya cargadas (BEGIN IMMEDIATE: los shards del DAG
+        # pueden registrar en paralelo sobre el mismo archivo)
+        claves = dataframe['unique_id'].astype(str)
+        maximos = dataframe.assign(ts=formatear_timestamps(dataframe['timestamp'])).groupby('city_name', observed=True)['ts'].max()
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            filtro = self._leer_filtro(conn) or FiltroBloom.para_capacidad(self.capacidad, self.error)
+            for clave in claves:
+                filtro.agregar(clave)
+            conn.execute(
+                "INSERT OR REPLACE INTO filtro (id, m_bits, k, bits) VALUES (1, ?, ?, ?)",
+                (filtro.m_bits, filtro.k, bytes(filtro.bits)),
+            )
+            conn.executemany(
+                """
+                INSERT INTO marcas (city_name, max_timestamp) VALUES (?, ?)
+                ON CONFLICT (city_name) DO UPDATE SET max_timestamp = MAX(max_timestamp, excluded.max_timestamp)
+                """,
+                [(str(ciudad), ts) for ciudad, ts in maximos.items()],
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def filtrar_nuevas(self, dataframe, conn_warehouse, tabla):
+        # Devuelve solo las filas cuyo unique_id no está cargado en 'tabla'
+        if dataframe.empty:
+            return dataframe
+        marcas = self.marcas()
+        with self._conectar() as conn:
+            filtro = self._leer_filtro(conn)
+        if filtro is None:
+            return dataframe
+
+        # Filas con init posterior a la marca de agua de su ciudad: nuevas sin más chequeos
+        marca = dataframe['city_name'].astype(object).map(marcas)
+        timestamps = formatear_timestamps(dataframe['timestamp'])
+        posibles = (marca.notna() & (timestamps <= marca.fillna(''))).to_numpy()
+
+        # Del resto, el filtro de Bloom descarta las que seguro no están cargadas
+        claves = dataframe['unique_id'].astype(str).to_numpy()
+        sospechosas = [clave for clave, posible in zip(claves, posibles) if posible and filtro.contiene(clave)]
+
+        # Las coincidencias del filtro se confirman con una consulta de claves al warehouse
+        cargadas = self._confirmar_en_warehouse(conn_warehouse, tabla, sospechosas)
+        nuevas = dataframe[~dataframe['unique_id'].astype(str).isin(cargadas)]
+        logging.info("Índice de cargas: %s filas, %s ya cargadas, %s nuevas", len(dataframe), len(dataframe) - len(nuevas), len(nuevas))
+        return nuevas
+
+    def _confirmar_en_warehouse(self, conn, tabla, claves, lote=5000):
+        cargadas = set()
+        if not claves:
+            return cargadas
+        cur = conn.cursor()
+        for inicio in range(0, len(claves), lote):
+            cur.execute(f"SELECT unique_id FROM {tabla} WHERE unique_id IN %s", (tuple(claves[inicio:inicio + lote]),))
+            cargadas.update(fila[0] for fila in cur.fetchall())
+        conn.commit()
+        return cargadas
+
+    @contextmanager
+    def _bloqueo_reconstruccion(self, espera=3600):
+        # BEGIN IMMEDIATE sobre un archivo aparte: un solo proceso reconstruye a la vez y el
+        # archivo del índice queda libre para los shards que registran mientras tanto
+        conn = sqlite3.connect(self.ruta + '.lock', timeout=espera, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+
+    def reconstruir_si_falta(self, conn, tabla):
+        if self.existe():
+            return
+        with self._bloqueo_reconstruccion():
+            # Otro shard pudo terminar la reconstrucción mientras se esperaba el bloqueo
+            if not self.existe():
+                self.reconstruir(conn, tabla)
+
+    def reconstruir(self, conn, tabla, lote=50000):
+        # Vuelve a armar marcas y filtro leyendo las claves de 'tabla' con un cursor del servidor
+        filtro = FiltroBloom.para_capacidad(self.capacidad, self.error)
+        marcas = {}
+        try:
+            cur = conn.cursor(name='reconstruir_indice_cargas')
+            cur.itersize = lote
+            cur.execute(f"SELECT unique_id, city_name, timestamp FROM {tabla}")
+            for unique_id, ciudad, timestamp in cur:
+                filtro.agregar(str(unique_id))
+                if timestamp is None:
+                    continue
+                # El timestamp se guarda como VARCHAR; se normaliza al mismo formato del índice
+                timestamp = pd.Timestamp(timestamp).strftime(FORMATO_TIMESTAMP)
+                if ciudad not in marcas or timestamp > marcas[ciudad]:
+                    marcas[ciudad] = timestamp
+            cur.close()
+            conn.commit()
+        except psycopg2.errors.UndefinedTable:
+            # Todavía no hay tabla: el índice arranca vacío
+            conn.rollback()
+
+        # Se combina con lo que ya tenga el índice en lugar de reemplazarlo: un shard pudo
+        # registrar claves mientras se leía el warehouse
+        conn_indice = self._conectar()
+        try:
+            conn_indice.execute("BEGIN IMMEDIATE")
+            actual = self._leer_filtro(conn_indice)
+            if actual is not None and (actual.m_bits, actual.k) == (filtro.m_bits, filtro.k):
+                filtro.unir(actual)
+            conn_indice.execute(
+                "INSERT OR REPLACE INTO filtro (id, m_bits, k, bits) VALUES (1, ?, ?, ?)",
+                (filtro.m_bits, filtro.k, bytes(filtro.bits)),
+            )
+            conn_indice.executemany(
+                """
+                INSERT INTO marcas (city_name, max_timestamp) VALUES (?, ?)
+                ON CONFLICT (city_name) DO UPDATE SET max_timestamp = MAX(max_timestamp, excluded.max_timestamp)
+                """,
+                list(marcas.items()),
+            )
+            conn_indice.commit()
+        except Exception:
+            conn_indice.rollback()
+            raise
+        finally:
+            conn_indice.close()
+        logging.info("Índice de cargas reconstruido desde %s: %s ciudades", tabla, len(marcas))
+
+
+# Función para abrir el índice y reconstruirlo desde el warehouse si no existe
+
+def obtener_indice(conn, tabla, ruta=ARCHIVO_INDICE, capacidad=2000000):
+    indice = IndiceCargas(ruta, capacidad=capacidad)
+    indice.reconstruir_si_falta(conn, tabla)
+    return indice
@@ -0,0 +1,112 @@
+# weather_cache.py
+
+# Cache en disco de las respuestas de 7timer, indexada por (lon, lat, parámetros)
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+
+class CachePronosticos:
+    """
+    Guarda el payload de 7timer junto con su 'init' y el DataFrame ya procesado.
+    Una entrada más nueva que ttl segundos evita la llamada a la API; si la entrada
+    venció pero la API devuelve el mismo 'init', se reutiliza el DataFrame sin reprocesar.
+    """
+
+    def __init__(self, directorio, ttl=3 * 3600, max_entradas=1000):
+        self.directorio = directorio
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.hits = 0
+        self.misses = 0
+        self.init_hits = 0
+        self.respaldos = 0
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, lon, lat, params):
+        clave = hashlib.sha1(f"{lon}|{lat}|{params}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directorio, f"{clave}.pkl")
+
+    def _leer(self, ruta):
+        try:
+            with open(ruta, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logging.warning(f"Entrada de cache corrupta {ruta}: {e}")
+            return None
+
+    def _contar(self, atributo):
+        with self._lock:
+            setattr(self, atributo, getattr(self, atributo) + 1)
+
+    def obtener_vigente(self, lon, lat, params):
+        # Devuelve la entrada si no venció el TTL, sin tocar la red
+        entrada = self._leer(self._ruta(lon, lat, params))
+        if entrada is not None and time.time() - entrada['guardado'] < self.ttl:
+            self._contar('hits')
+            return entrada
+        self._contar('misses')
+        return None
+
+    def obtener_por_init(self, lon, lat, params, init):
+        # Devuelve la entrada si el 'init' coincide con el recién descargado
+        entrada = self._leer(self._ruta(lon, lat, params))
+        if entrada is not None and entrada['init'] == init:
+            self._contar('init_hits')
+            # Se renueva la fecha de guardado para extender el TTL
+            self.guardar(lon, lat, params, entrada['payload'], entrada['city_name'], entrada['df'])
+            return entrada
+        return None
+
+    def obtener_respaldo(self, lon, lat, params):
+        # Devuelve la última entrada guardada aunque haya vencido el TTL (se usa cuando
+        # la API no responde o su circuito está abierto)
+        entrada = self._leer(self._ruta(lon, lat, params))
+        if entrada is not None:
+            self._contar('respaldos')
+        return entrada
+
+    def guardar(self, lon, lat, params, payload, city_name, df):
+        entrada = {
+            'payload': payload,
+            'init': payload.get('init'),
+            'city_name': city_name,
+            'df': df,
+            'guardado': time.time(),
+        }
+        ruta = self._ruta(lon, lat, params)
+        # Escritura atómica: archivo temporal y luego rename
+        fd, tmp = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entrada, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, ruta)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._desalojar()
+
+    def _desalojar(self):
+        # Si se supera el máximo de entradas se eliminan las más antiguas
+        archivos = [os.path.join(self.directorio, n) for n in os.listdir(self.directorio) if n.endswith('.pkl')]
+        sobrantes = len(archivos) - self.max_entradas
+        if sobrantes <= 0:
+            return
+        archivos.sort(key=lambda ruta: os.path.getmtime(ruta) if os.path.exists(ruta) else 0)
+        for ruta in archivos[:sobrantes]:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+    def registrar_estadisticas(self):
+        logging.info(f"Cache de pronósticos: {self.hits} hits, {self.misses} misses, {self.init_hits} init sin cambios, {self.respaldos} respaldos vencidos")
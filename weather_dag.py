@@ -1,12 +1,17 @@
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
+from airflow.models.xcom_arg import XComArg
 from datetime import datetime, timedelta
-import pandas as pd
 import logging
 import json
 import os
+import functools
 
-from weather_script import run_weather_etl, check_temperature_alerts, send_email_alert 
+from weather_script import (
+    run_weather_etl_shard, check_temperature_alerts, send_email_alert, cargar_datos_xcom,
+    cargar_configuracion, dividir_en_shards, combinar_resultados_shards,
+)
+from metrics import registro as metricas
 
 # Se definen argumentos
 
@@ -30,28 +35,65 @@ dag = DAG(
     catchup=True,
 ) 
 
-# Primer tarea para comenzar toma de datos, conexion y carga a Redshift. Se utiliza XCom para vincular data entre tareas
+# Decorador para dejar en el log de cada tarea el resumen de tiempos por etapa de esa corrida
+# (el registro se reinicia al comenzar, porque el proceso del worker puede ejecutar varias tareas)
+
+def con_resumen_tiempos(tarea):
+    @functools.wraps(tarea)
+    def envoltura(*args, **kwargs):
+        metricas.reiniciar()
+        try:
+            return tarea(*args, **kwargs)
+        finally:
+            metricas.registrar_resumen(tarea.__name__)
+    return envoltura
+
+# Primer tarea: se leen las ciudades de config_alertas.json y se dividen en shards
+
+@con_resumen_tiempos
+def task_preparar_shards(**kwargs):
+
+    logging.info("Starting task_preparar_shards")
+
+    config = cargar_configuracion()
+    shard_size = config.get('dag_settings', {}).get('shard_size', 10)
+    shards = dividir_en_shards(config['cities'], shard_size)
+    logging.info(f"{len(config['cities'])} ciudades divididas en {len(shards)} shards")
+
+    # Cada elemento se convierte en los op_kwargs de una tarea mapeada
+    return [{'cities': shard['cities'], 'shard_id': shard['shard_id']} for shard in shards]
+
+# Tarea mapeada: cada shard toma datos, los procesa y los carga en Redshift de forma independiente
+
+@con_resumen_tiempos
+def task_run_weather_etl_shard(cities, shard_id, **kwargs):
+
+    logging.info(f"Starting task_run_weather_etl_shard {shard_id}")
 
-def task_run_weather_etl(**kwargs):
+    return run_weather_etl_shard(cities, shard_id, run_id=kwargs.get('run_id'))
 
-    logging.info("Starting task_run_weather_etl")
+# Reducción: se combinan los resultados de los shards y se publican por XCom para las alertas
 
-    weather_data_dict = run_weather_etl()
-    kwargs['ti'].xcom_push(key='weather_data', value=weather_data_dict)
+@con_resumen_tiempos
+def task_combinar_shards(**kwargs):
 
-# Segunda tarea para chequear alertas
+    logging.info("Starting task_combinar_shards")
 
+    ti = kwargs['ti']
+    resultados = ti.xcom_pull(task_ids='run_weather_etl_shard', key='return_value')
+    weather_data = combinar_resultados_shards(list(resultados or []))
+    ti.xcom_push(key='weather_data', value=weather_data)
+
+# Tarea para chequear alertas sobre los datos combinados
+
+@con_resumen_tiempos
 def task_check_temperature_alerts(**kwargs):
 
     logging.info("Starting task_check_temperature_alerts")
 
     ti = kwargs['ti']
-    weather_data_dict = ti.xcom_pull(key='weather_data', task_ids='run_weather_etl')
-    weather_data_df = pd.DataFrame(weather_data_dict)
-
-    # Convertir columnas necesarias a su tipo adecuado
-    weather_data_df['temp2m'] = pd.to_numeric(weather_data_df['temp2m'])
-    weather_data_df['timestamp'] = pd.to_datetime(weather_data_df['timestamp'])
+    weather_data_dict = ti.xcom_pull(key='weather_data', task_ids='combine_weather_shards')
+    weather_data_df = cargar_datos_xcom(weather_data_dict)
 
     # Cargar configuración desde archivo JSON
     file_path = os.path.join(os.path.dirname(__file__),'config_alertas.json')
@@ -59,12 +101,14 @@ def task_check_temperature_alerts(**kwargs):
         config = json.load(config_file)
 
     temp_limits = config['temperature_limits']
+    metric_limits = config.get('metric_limits', {})
 
-    alerts = check_temperature_alerts(weather_data_df, temp_limits)
+    alerts = check_temperature_alerts(weather_data_df, temp_limits, metric_limits)
     kwargs['ti'].xcom_push(key='alerts', value=alerts)
 
-# Tercer tarea para enviar alertas por mail
+# Tarea final para enviar alertas por mail
 
+@con_resumen_tiempos
 def task_send_email_alert(**kwargs):
 
     logging.info("Starting task_send_email_alert")
@@ -82,9 +126,23 @@ def task_send_email_alert(**kwargs):
         email_settings = config['email_settings']
         send_email_alert(alerts, email_settings)
 
-run_weather_etl_task = PythonOperator(
-    task_id='run_weather_etl',
-    python_callable=task_run_weather_etl,
+preparar_shards_task = PythonOperator(
+    task_id='prepare_weather_shards',
+    python_callable=task_preparar_shards,
+    provide_context=True,
+    dag=dag,
+)
+
+# Mapeo dinámico: una tarea por shard, que Airflow puede ejecutar y reintentar por separado
+run_weather_etl_shard_task = PythonOperator.partial(
+    task_id='run_weather_etl_shard',
+    python_callable=task_run_weather_etl_shard,
+    dag=dag,
+).expand(op_kwargs=XComArg(preparar_shards_task))
+
+combinar_shards_task = PythonOperator(
+    task_id='combine_weather_shards',
+    python_callable=task_combinar_shards,
     provide_context=True,
     dag=dag,
 )
@@ -103,4 +161,4 @@ send_email_alert_task = PythonOperator(
     dag=dag,
 )
 
-run_weather_etl_task >> check_temperature_alerts_task >> send_email_alert_task
+run_weather_etl_shard_task >> combinar_shards_task >> check_temperature_alerts_task >> send_email_alert_task
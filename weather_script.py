@@ -3,6 +3,9 @@
 #Se importan las librerias necesarias
 
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+from pyarrow import feather
 import pandas as pd
 from tabulate import tabulate
 import pytz
@@ -11,113 +14,333 @@ import psycopg2
 from psycopg2.extras import execute_values
 import json
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import io
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from contextlib import contextmanager
+
+from redshift_pool import cargar_credenciales, obtener_pool
+from weather_cache import CachePronosticos
+from alert_dispatcher import DespachadorAlertas
+from metrics import medir, incrementar
+from watermark_index import obtener_indice
+from resilience import obtener_breaker, llamar_con_reintentos, Plazo, CircuitoAbierto, PlazoAgotado
+
+# Función para obtener los umbrales de cada fila (por ciudad, con los globales como valor por defecto)
+
+def umbrales_por_ciudad(ciudades, limites, clave_max, clave_min):
+    por_ciudad = limites.get('cities', {})
+    maximos = ciudades.map({c: v[clave_max] for c, v in por_ciudad.items() if clave_max in v})
+    minimos = ciudades.map({c: v[clave_min] for c, v in por_ciudad.items() if clave_min in v})
+    maximos = maximos.astype(float).fillna(limites.get(clave_max, float('inf')))
+    minimos = minimos.astype(float).fillna(limites.get(clave_min, float('-inf')))
+    return maximos, minimos
 
 # Función para chequeo de alertas
+# temp_limits admite umbrales por ciudad en temp_limits['cities'] y metric_limits
+# define reglas extra por columna, p. ej. {"wind_speed": {"max": 6, "cities": {...}}}
 
-def check_temperature_alerts(dataframe, temp_limits):
+def check_temperature_alerts(dataframe, temp_limits, metric_limits=None):
+    with medir('chequeo_alertas'):
+        alerts = _buscar_alertas(dataframe, temp_limits, metric_limits)
+    incrementar('alertas', len(alerts))
+    return alerts
+
+# Generador con una máscara booleana por regla de alerta: primero temp2m (metrica=None) y
+# luego cada métrica de metric_limits presente en el DataFrame, como (metrica, columna, mask)
+
+def mascaras_alerta(dataframe, temp_limits, metric_limits=None):
+    ciudades = dataframe['city_name'].astype(object)
+    reglas = [(None, 'temp2m', temp_limits, 'max_temp', 'min_temp')]
+    reglas += [(metrica, metrica, limites, 'max', 'min') for metrica, limites in (metric_limits or {}).items() if metrica in dataframe.columns]
+    for metrica, columna, limites, clave_max, clave_min in reglas:
+        maximos, minimos = umbrales_por_ciudad(ciudades, limites, clave_max, clave_min)
+        valores = dataframe[columna]
+        yield metrica, columna, ((valores > maximos.values) | (valores < minimos.values)).to_numpy()
+
+def _buscar_alertas(dataframe, temp_limits, metric_limits):
     alerts = []
-    for index, row in dataframe.iterrows():
-        if row['temp2m'] > temp_limits['max_temp'] or row['temp2m'] < temp_limits['min_temp']:
-            timestamp_str = str(row['timestamp'])
-            alerts.append(f"Temperature alert! {row['city_name']} at {timestamp_str} has a temperature of {row['temp2m']}°C.")
+    if dataframe.empty:
+        return alerts
+
+    for metrica, columna, mask in mascaras_alerta(dataframe, temp_limits, metric_limits):
+        # El texto se arma solo para las filas que disparan la alerta
+        coincidencias = dataframe[mask]
+        for city, timestamp, valor in zip(coincidencias['city_name'], coincidencias['timestamp'], coincidencias[columna]):
+            if metrica is None:
+                alerts.append(f"Temperature alert! {city} at {str(timestamp)} has a temperature of {valor}°C.")
+            else:
+                alerts.append(f"{metrica} alert! {city} at {str(timestamp)} has a {metrica} of {valor}.")
+
     return alerts
 
+# Función para marcar las filas que disparan al menos una regla de alerta
+# (se usa en el modo streaming para quedarse solo con los candidatos de cada bloque)
+
+def mascara_candidatos_alerta(dataframe, temp_limits, metric_limits=None):
+    mask = np.zeros(len(dataframe), dtype=bool)
+    for _, _, mask_regla in mascaras_alerta(dataframe, temp_limits, metric_limits):
+        mask |= mask_regla
+    return mask
+
 # Función para enviar mails con alertas
+# Las alertas se agrupan en un digest por destinatario (email_settings.routes permite
+# rutear por ciudad) y se envían por una única conexión SMTP desde un hilo aparte
 
 def send_email_alert(alerts, email_settings):
 
-    from_email = email_settings['from_email']
-    from_password = email_settings['from_password']
-    to_email = email_settings['to_email']
-
-    subject = "Weather Alert"
-    body = "The following cities have temperatures alerts:\n\n"
-    
-    for alert in alerts:
-        body += f"{alert}\n"
-
-    msg = MIMEMultipart()
-    msg['From'] = from_email
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    
-    msg.attach(MIMEText(body, 'plain'))
-    
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(from_email, from_password)
-        text = msg.as_string()
-        server.sendmail(from_email, to_email, text)
-        server.quit()
+    despachador = DespachadorAlertas(
+        email_settings,
+        ventana=email_settings.get('digest_window', 5.0),
+        intervalo_envio=email_settings.get('min_send_interval', 1.0),
+    )
+    with medir('envio_alertas'):
+        despachador.encolar(alerts)
+
+        # Se espera a que el hilo termine de enviar antes de que finalice la tarea: el envío
+        # sigue bloqueando la tarea, lo que se ahorra son conexiones y mails (un digest por destinatario)
+        despachador.cerrar()
+
+    if despachador.fallidos:
+        print(f"Failed to send {despachador.fallidos} email(s)")
+    else:
         print("Email sent successfully!")
-    except Exception as e:
-        print(f"Failed to send email: {str(e)}")
 
-# Función para tomar data del clima
-
-def get_weather_data(lon, lat, city_name):
-    # Se contruye la URL en función de las coordenadas
-    url = f"https://www.7timer.info/bin/astro.php?lon={lon}&lat={lat}&ac=0&unit=metric&output=json&tzshift=0"
+# URL base de la API de pronósticos 7timer
+URL_7TIMER = "https://www.7timer.info/bin/astro.php"
+PARAMS_7TIMER = "ac=0&unit=metric&output=json&tzshift=0"
 
-    # Se obtiene el JSON desde la URL
-    response = requests.get(url)
-    data = response.json()
+# Timeout por solicitud a 7timer cuando no se configura otro (fetch_settings.timeout)
+TIMEOUT_7TIMER = 30
 
-    # Se convierte el JSON en un DataFrame
-    df = pd.DataFrame(data['dataseries'])
+# Función para crear una sesión HTTP con conexiones keep-alive reutilizables
 
-    # Se separa el diccionario dentro de la columna 'wind10m' en columnas separadas
-    wind_data = pd.json_normalize(df['wind10m'])
+def crear_sesion_http(max_conexiones=10):
+    session = requests.Session()
+    # Se dimensiona el pool para que cada hilo tenga su propia conexión al host
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_conexiones)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-    # Se renombra las columnas resultantes
-    wind_data.columns = ['wind_direction', 'wind_speed']
+# Función para descargar el JSON del pronóstico
 
-    # Se elimina la columna original 'wind10m' del DataFrame
-    df.drop(columns=['wind10m'], inplace=True)
+# Las solicitudes pasan por el circuit breaker de 7timer, con reintentos con jitter acotados
+# por el plazo total 'plazo' (resilience_settings en config_alertas.json)
 
-    # Se concatena las nuevas columnas al DataFrame original
-    df = pd.concat([df, wind_data], axis=1)
+def descargar_datos_clima(lon, lat, session=None, timeout=None, plazo=None, resiliencia=None):
+    # Se contruye la URL en función de las coordenadas
+    url = f"{URL_7TIMER}?lon={lon}&lat={lat}&{PARAMS_7TIMER}"
+
+    # Se obtiene el JSON desde la URL (reutilizando la sesión si se recibe una)
+    cliente = session if session is not None else requests
+    resiliencia = resiliencia or {}
+    breaker = obtener_breaker(
+        '7timer',
+        umbral_fallas=resiliencia.get('failure_threshold', 5),
+        tiempo_apertura=resiliencia.get('open_seconds', 60),
+    )
+
+    def solicitar(timeout_intento):
+        response = cliente.get(url, timeout=timeout_intento)
+        response.raise_for_status()
+        return response.json()
+
+    with medir('api_7timer'):
+        return llamar_con_reintentos(
+            solicitar,
+            breaker,
+            plazo=plazo,
+            timeout=timeout if timeout is not None else TIMEOUT_7TIMER,
+            reintentos=resiliencia.get('retries', 2),
+            base=resiliencia.get('backoff_base', 0.5),
+            maximo=resiliencia.get('backoff_max', 10),
+        )
+
+# Función para convertir el JSON del pronóstico en un DataFrame
+# Se recorre 'dataseries' una sola vez armando listas por columna (con 'wind10m'
+# aplanado en el mismo recorrido) y se construye el DataFrame en un único paso
+
+def procesar_datos_clima(data, city_name):
+    dataseries = data['dataseries']
+    n = len(dataseries)
+
+    # Columnas en el mismo orden que las claves del JSON, sin 'wind10m'
+    claves = [k for k in (dataseries[0] if n else {}) if k != 'wind10m']
+    columnas = {k: [None] * n for k in claves}
+    wind_direction = [None] * n
+    wind_speed = [None] * n
+
+    for i, registro in enumerate(dataseries):
+        for k in claves:
+            columnas[k][i] = registro.get(k)
+        viento = registro.get('wind10m') or {}
+        wind_direction[i] = viento.get('direction')
+        wind_speed[i] = viento.get('speed')
+
+    columnas['wind_direction'] = wind_direction
+    columnas['wind_speed'] = wind_speed
 
     # Se agrega columna de tiempo en formato de fecha y hora
-    df['timestamp'] = pd.to_datetime(data['init'], format='%Y%m%d%H')
+    timestamp = pd.to_datetime(data['init'], format='%Y%m%d%H')
+    columnas['timestamp'] = timestamp
+
+    # Se agrega columna con el nombre de la ciudad como categoría (un solo valor por ciudad)
+    columnas['city_name'] = pd.Categorical.from_codes(np.zeros(n, dtype='int8'), categories=[city_name])
+
+    # Se crea la columna 'unique_id' ('timestamp'_'timepoint'_'city_name'); el prefijo
+    # se formatea una sola vez igual que lo haría astype(str) sobre la columna
+    prefijo = pd.Series([timestamp]).astype(str).iloc[0] + '_'
+    sufijo = '_' + city_name
+    columnas['unique_id'] = [prefijo + str(tp) + sufijo for tp in columnas.get('timepoint', [])]
+
+    return pd.DataFrame(columnas)
+
+# Función para tomar data del clima
+
+def get_weather_data(lon, lat, city_name, session=None, timeout=None, cache=None, plazo=None, resiliencia=None):
+    if cache is None:
+        data = descargar_datos_clima(lon, lat, session=session, timeout=timeout, plazo=plazo, resiliencia=resiliencia)
+        with medir('parseo_clima'):
+            df = procesar_datos_clima(data, city_name)
+        print('Data retrieved from API successfully!')
+        return df
 
-    # Se agrega columna con el nombre de la ciudad
-    df['city_name'] = city_name
+    # Si la entrada en cache sigue vigente no se llama a la API
+    entrada = cache.obtener_vigente(lon, lat, PARAMS_7TIMER)
+    if entrada is not None and entrada['city_name'] == city_name:
+        print('Data retrieved from cache!')
+        return entrada['df']
 
-    # Se crea la columna 'unique_id' concatenando 'timestamp', 'timepoint' y 'city_name'
-    df['unique_id'] = df['timestamp'].astype(str) + '_' + df['timepoint'].astype(str) + '_' + df['city_name']
+    try:
+        data = descargar_datos_clima(lon, lat, session=session, timeout=timeout, plazo=plazo, resiliencia=resiliencia)
+    except (CircuitoAbierto, PlazoAgotado, requests.exceptions.RequestException, ValueError) as e:
+        # Con el circuito abierto, sin plazo o con la API caída se sirve la última entrada
+        # en cache aunque esté vencida, sin esperar el timeout
+        entrada = cache.obtener_respaldo(lon, lat, PARAMS_7TIMER)
+        if entrada is None or entrada['city_name'] != city_name:
+            raise
+        print(f'API unavailable ({e}), data retrieved from stale cache!')
+        return entrada['df']
+
+    # Si el 'init' del modelo no cambió se reutiliza el DataFrame ya procesado
+    entrada = cache.obtener_por_init(lon, lat, PARAMS_7TIMER, data.get('init'))
+    if entrada is not None and entrada['city_name'] == city_name:
+        df = entrada['df']
+    else:
+        with medir('parseo_clima'):
+            df = procesar_datos_clima(data, city_name)
+        cache.guardar(lon, lat, PARAMS_7TIMER, data, city_name, df)
 
     print('Data retrieved from API successfully!')
 
     return df
 
+# Función para crear la cache de pronósticos a partir de cache_settings (None si está deshabilitada)
+
+def crear_cache_pronosticos(cache_settings):
+    if not cache_settings.get('enabled', False):
+        return None
+    directorio = cache_settings.get('directory', os.path.join(os.path.dirname(__file__), 'weather_cache'))
+    return CachePronosticos(
+        directorio,
+        ttl=cache_settings.get('ttl', 3 * 3600),
+        max_entradas=cache_settings.get('max_entries', 1000),
+    )
+
+# Función que entrega 'tomar_ciudad(location)' para descargar una ubicación con la configuración dada
+# Con más de una descarga simultánea se comparte una sesión keep-alive con un pool por hilo
+
+@contextmanager
+def descargador_ciudades(max_concurrencia=1, timeout=TIMEOUT_7TIMER, cache=None, plazo=None, resiliencia=None):
+    session = crear_sesion_http(max_conexiones=max_concurrencia) if max_concurrencia > 1 else None
+
+    def tomar_ciudad(location):
+        return get_weather_data(
+            location['lon'], location['lat'], location['name'],
+            session=session, timeout=timeout, cache=cache, plazo=plazo, resiliencia=resiliencia,
+        )
+
+    try:
+        yield tomar_ciudad
+    finally:
+        if session is not None:
+            session.close()
+
+# Función para tomar data del clima de varias ciudades en paralelo
+
+def get_weather_data_concurrente(locations, max_concurrencia=8, timeout=30, cache=None, plazo=None, resiliencia=None):
+    # Se limita la cantidad de solicitudes simultáneas al host de 7timer
+    max_concurrencia = max(1, min(max_concurrencia, len(locations) or 1))
+
+    with descargador_ciudades(max_concurrencia, timeout, cache, plazo, resiliencia) as tomar_ciudad:
+        with ThreadPoolExecutor(max_workers=max_concurrencia) as executor:
+            # executor.map conserva el orden de las ubicaciones, igual que el recorrido secuencial
+            return list(executor.map(tomar_ciudad, locations))
+
+# Generador que devuelve el DataFrame de cada ciudad a medida que llega, en el orden de
+# 'locations', con a lo sumo 'max_concurrencia' descargas en vuelo (memoria acotada)
+
+def iterar_pronosticos(locations, max_concurrencia=1, timeout=TIMEOUT_7TIMER, cache=None, plazo=None, resiliencia=None):
+    with descargador_ciudades(max_concurrencia, timeout, cache, plazo, resiliencia) as tomar_ciudad:
+        if max_concurrencia <= 1:
+            for location in locations:
+                yield tomar_ciudad(location)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_concurrencia) as executor:
+            en_vuelo = deque()
+            for location in locations:
+                en_vuelo.append(executor.submit(tomar_ciudad, location))
+                if len(en_vuelo) >= max_concurrencia:
+                    yield en_vuelo.popleft().result()
+            while en_vuelo:
+                yield en_vuelo.popleft().result()
+
+# Generador que agrupa DataFrames limpios en bloques de al menos 'filas_por_bloque' filas
+
+def agrupar_en_bloques(dataframes, filas_por_bloque):
+    pendientes = []
+    filas = 0
+    for df in dataframes:
+        pendientes.append(df)
+        filas += len(df)
+        if filas >= filas_por_bloque:
+            yield pd.concat(pendientes, ignore_index=True)
+            pendientes = []
+            filas = 0
+    if pendientes:
+        yield pd.concat(pendientes, ignore_index=True)
+
+# Función para generar la sentencia CREATE TABLE a partir de los tipos del DataFrame
+
+def generar_esquema_tabla(tabla, dataframe):
+    # Se obtiene los tipos de datos de las columnas del DataFrame
+    dtypes = dataframe.dtypes
+    cols = list(dtypes.index)
+    tipos = list(map(str, dtypes.values))
+    # Se Mapea los tipos de datos de Pandas a tipos de datos de Redshift
+    type_map = {'int64': 'INT', 'float64': 'FLOAT', 'object': 'VARCHAR(50)', 'category': 'VARCHAR(50)', 'datetime64[ns]': 'VARCHAR(50)'}
+    # Se obtiene los tipos de datos de Redshift correspondientes
+    sql_dtypes = [type_map[str(dtype)] for dtype in tipos]
+    # Se define formato SQL para las columnas
+    column_defs = [f"{name} {data_type}" for name, data_type in zip(cols, sql_dtypes)]
+    # Definición de la clave primaria
+    primary_key = "unique_id"
+    # Se combina las definiciones de columnas en la sentencia CREATE TABLE
+    table_schema = f"""
+        CREATE TABLE IF NOT EXISTS {tabla} (
+            {', '.join(column_defs)},
+            PRIMARY KEY ({primary_key})
+        );
+        """
+    return cols, table_schema
+
 # Función para cargar datos en Redshift
 def cargar_en_redshift(conn, tabla, dataframe):
     try:
-        # Se obtiene los tipos de datos de las columnas del DataFrame
-        dtypes = dataframe.dtypes
-        cols = list(dtypes.index)
-        tipos = list(map(str, dtypes.values))
-        # Se Mapea los tipos de datos de Pandas a tipos de datos de Redshift
-        type_map = {'int64': 'INT', 'float64': 'FLOAT', 'object': 'VARCHAR(50)', 'datetime64[ns]': 'VARCHAR(50)'}
-        # Se obtiene los tipos de datos de Redshift correspondientes
-        sql_dtypes = [type_map[str(dtype)] for dtype in tipos]
-        # Se define formato SQL para las columnas
-        column_defs = [f"{name} {data_type}" for name, data_type in zip(cols, sql_dtypes)]
-        # Definición de la clave primaria
-        primary_key = "unique_id"
-        # Se combina las definiciones de columnas en la sentencia CREATE TABLE
-        table_schema = f"""
-            CREATE TABLE IF NOT EXISTS {tabla} (
-                {', '.join(column_defs)},
-                PRIMARY KEY ({primary_key})
-            );
-            """
+        cols, table_schema = generar_esquema_tabla(tabla, dataframe)
         # Se crea la tabla en Redshift
         cur = conn.cursor()
         cur.execute(table_schema)
@@ -131,8 +354,53 @@ def cargar_en_redshift(conn, tabla, dataframe):
         execute_values(cur, insert_sql, values)
         cur.execute("COMMIT")
         print('Proceso de carga en Redshift terminado')
+        return True
+    except Exception as e:
+        print(f"Error al cargar datos en Redshift: {str(e)}")
+        return False
+
+# Función para carga masiva con COPY a una tabla staging y merge por unique_id
+# COPY ... FROM STDIN funciona en PostgreSQL; en Redshift COPY solo lee desde S3,
+# por eso con usar_copy=False la tabla staging se llena con execute_values
+
+def cargar_en_redshift_copy(conn, tabla, dataframe, chunk_size=50000, usar_copy=True):
+    staging = f"{tabla}_staging"
+    try:
+        cols, table_schema = generar_esquema_tabla(tabla, dataframe)
+        columnas = ', '.join(cols)
+        cur = conn.cursor()
+        # Se crea la tabla destino y una tabla staging temporal con la misma estructura
+        cur.execute(table_schema)
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {tabla})")
+
+        # Se recorre el DataFrame por bloques para acotar el uso de memoria
+        for inicio in range(0, len(dataframe), chunk_size):
+            bloque = dataframe.iloc[inicio:inicio + chunk_size].drop_duplicates(subset='unique_id', keep='last')
+            # DELETE y no TRUNCATE: en Redshift TRUNCATE confirma la transacción en curso
+            cur.execute(f"DELETE FROM {staging}")
+
+            if usar_copy:
+                buffer = io.StringIO()
+                # Formato de fecha fijo, igual al que deja el INSERT (sin él las medianoches se escriben sin hora)
+                bloque.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+                buffer.seek(0)
+                cur.copy_expert(f"COPY {staging} ({columnas}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                values = [tuple(x) for x in bloque.to_numpy()]
+                execute_values(cur, f"INSERT INTO {staging} ({columnas}) VALUES %s", values)
+
+            # Merge: se reemplazan las filas existentes y se insertan las nuevas
+            cur.execute(f"DELETE FROM {tabla} USING {staging} WHERE {tabla}.unique_id = {staging}.unique_id")
+            cur.execute(f"INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM {staging}")
+
+        # Se confirma la transacción completa una vez cargados todos los bloques
+        conn.commit()
+        print('Proceso de carga en Redshift terminado')
+        return True
     except Exception as e:
+        conn.rollback()
         print(f"Error al cargar datos en Redshift: {str(e)}")
+        return False
 
 # Función para conectar a redshift
 
@@ -141,17 +409,10 @@ def conectar_redshift():
   secret_file_path = 'secret.json' 
 
   try:
-      # Se obtiene el secreto
-      with open(secret_file_path) as f:
-            secreto = json.load(f)
+      # Se obtiene el secreto (cacheado después de la primera lectura)
+      secreto = cargar_credenciales(secret_file_path)
       # Se conecta a Redshift utilizando las credenciales
-      conn = psycopg2.connect(
-          dbname=secreto['dbname'],
-          user=secreto['user'],
-          password=secreto['password'],
-          host=secreto['host'],
-          port=secreto['port']
-      )
+      conn = psycopg2.connect(**secreto)
       print("Connected to Redshift successfully!")
       return conn
 
@@ -165,27 +426,236 @@ def conectar_redshift():
         print(fnf_error)
         return None
 
-# Función para comenzar el trabajo diario de tomar información del clima
+# Función para tomar prestada una conexión del pool compartido (None si no se puede conectar)
 
-def run_weather_etl():
+@contextmanager
+def conexion_redshift(pool_settings=None):
+    pool = None
+    conn = None
+    try:
+        pool = obtener_pool(**(pool_settings or {}))
+        conn = pool.obtener()
+    except (psycopg2.Error, TimeoutError) as e:
+        print("Unable to connect to Redshift.")
+        print(e)
+    except FileNotFoundError as fnf_error:
+        print("El archivo secret.json no se encontró en la ubicación especificada.")
+        print(fnf_error)
+
+    try:
+        yield conn
+    finally:
+        # La conexión vuelve al pool en lugar de cerrarse
+        if conn is not None:
+            pool.devolver(conn)
+
+# Función para cargar un DataFrame con el método definido en load_settings
+# Con load_settings.skip_loaded se consulta el índice local de claves cargadas
+# (watermark_index.py) y solo se envían las filas nuevas
+
+def cargar_datos_warehouse(conn, dataframe, load_settings, tabla='tabla_temperatura'):
+    indice = None
+    if load_settings.get('skip_loaded', False):
+        with medir('indice_cargas'):
+            indice = obtener_indice(
+                conn, tabla,
+                ruta=load_settings.get('index_path', os.path.join(os.path.dirname(__file__), 'indice_cargas.sqlite')),
+                capacidad=load_settings.get('index_capacity', 2000000),
+            )
+            total = len(dataframe)
+            dataframe = indice.filtrar_nuevas(dataframe, conn, tabla)
+        incrementar('filas_omitidas', total - len(dataframe))
+        if dataframe.empty:
+            print('No hay filas nuevas para cargar en Redshift')
+            return
+
+    with medir('carga_redshift'):
+        cargado = _cargar_datos_warehouse(conn, dataframe, load_settings, tabla)
+    if not cargado:
+        incrementar('cargas_fallidas')
+        # Con load_settings.raise_on_failure (shards del DAG) la tarea falla y Airflow la reintenta
+        if load_settings.get('raise_on_failure', False):
+            raise Exception(f"Error al cargar {len(dataframe)} filas en {tabla}")
+        return
+    incrementar('filas_cargadas', len(dataframe))
+
+    # Solo se registran en el índice las filas de una carga confirmada
+    if indice is not None:
+        indice.registrar(dataframe)
+
+# Función para avisar que no hay conexión a Redshift (con raise_on_failure la tarea falla)
+
+def sin_conexion_warehouse(load_settings):
+    if load_settings.get('raise_on_failure', False):
+        raise Exception("No hay conexión a Redshift para cargar los datos")
+    print('Se omite la carga en Redshift: no hay conexión')
+
+def _cargar_datos_warehouse(conn, dataframe, load_settings, tabla):
+    if load_settings.get('bulk_upsert', False):
+        return cargar_en_redshift_copy(
+            conn=conn,
+            tabla=tabla,
+            dataframe=dataframe,
+            chunk_size=load_settings.get('chunk_size', 50000),
+            usar_copy=load_settings.get('use_copy', True),
+        )
+    else:
+        return cargar_en_redshift(conn=conn, tabla=tabla, dataframe=dataframe)
+
+# Función para guardar el DataFrame como artefacto columnar (Arrow/Feather o Parquet) y devolver su ruta
+
+def guardar_artefacto(dataframe, xcom_settings, run_id=None):
+    directorio = xcom_settings.get('artifact_dir', os.path.join(os.path.dirname(__file__), 'artifacts'))
+    formato = xcom_settings.get('format', 'feather')
+    os.makedirs(directorio, exist_ok=True)
+
+    # Se eliminan artefactos de corridas anteriores que superen la retención
+    limite = datetime.now().timestamp() - xcom_settings.get('retention_days', 7) * 86400
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        if nombre.startswith('weather_') and os.path.getmtime(ruta) < limite:
+            os.remove(ruta)
+
+    # El nombre del archivo se arma con el run_id de Airflow (sin caracteres no válidos)
+    sufijo = "".join(c if c.isalnum() or c in '-_' else '_' for c in (run_id or datetime.now().strftime('%Y%m%d%H%M%S%f')))
+    ruta = os.path.join(directorio, f"weather_{sufijo}.{formato}")
+    tmp = ruta + '.tmp'
+
+    dataframe = dataframe.reset_index(drop=True)
+    with medir('escritura_artefacto'):
+        if formato == 'parquet':
+            dataframe.to_parquet(tmp, index=False)
+        else:
+            # Feather sin compresión permite leerlo luego con memory map
+            dataframe.to_feather(tmp, compression='uncompressed')
+        os.replace(tmp, ruta)
+    return ruta
+
+# Función para leer los datos que llegan por XCom (ruta a un artefacto o lista de registros)
+
+def cargar_datos_xcom(weather_data):
+    # Lista de rutas (un artefacto por shard): se leen y se combinan
+    if weather_data and isinstance(weather_data, list) and all(isinstance(r, str) for r in weather_data):
+        return pd.concat([cargar_datos_xcom(ruta) for ruta in weather_data], ignore_index=True)
+
+    if isinstance(weather_data, str):
+        if weather_data.endswith('.parquet'):
+            return pd.read_parquet(weather_data)
+        # Lectura con memory map: las columnas numéricas no se copian
+        tabla = feather.read_table(weather_data, memory_map=True)
+        return tabla.to_pandas()
+
+    # Sin registros (p. ej. el modo streaming sin candidatos a alerta) se devuelve un
+    # DataFrame vacío con las columnas que espera check_temperature_alerts
+    if not weather_data:
+        return pd.DataFrame({
+            'city_name': pd.Series(dtype=object),
+            'timestamp': pd.Series(dtype='datetime64[ns]'),
+            'temp2m': pd.Series(dtype=float),
+        })
+
+    weather_data_df = pd.DataFrame(weather_data)
+
+    # Convertir columnas necesarias a su tipo adecuado
+    weather_data_df['temp2m'] = pd.to_numeric(weather_data_df['temp2m'])
+    weather_data_df['timestamp'] = pd.to_datetime(weather_data_df['timestamp'])
+    return weather_data_df
+
+# Función para cargar la configuración desde config_alertas.json
+
+def cargar_configuracion():
 
     file_path = os.path.join(os.path.dirname(__file__),'config_alertas.json')
 
     # Cargar configuración de alertas desde archivo JSON
     with open(file_path) as config_file:
-        config = json.load(config_file)
+        return json.load(config_file)
+
+# Función para dividir las ciudades en shards de tamaño fijo (uno por tarea mapeada del DAG)
+
+def dividir_en_shards(locations, shard_size):
+    shard_size = max(1, shard_size)
+    return [
+        {'shard_id': i // shard_size, 'cities': locations[i:i + shard_size]}
+        for i in range(0, len(locations), shard_size)
+    ]
+
+# Función para comenzar el trabajo diario de tomar información del clima
+
+def run_weather_etl(run_id=None):
+
+    config = cargar_configuracion()
 
     # Se obtienen datos meteorológicos para diferentes ubicaciones (editable desde config_alertas.json)
-    locations = config['cities']
-    temp_limits = config['temperature_limits']
+    return run_weather_etl_ciudades(config['cities'], config, run_id=run_id)
+
+# Función para procesar un shard de ciudades de forma independiente
+# La carga siempre hace upsert para que un reintento del shard sea idempotente, llena la
+# staging con execute_values salvo que load_settings.use_copy diga otra cosa (Redshift no
+# acepta COPY ... FROM STDIN) y una carga fallida hace fallar la tarea para que se reintente
+
+def run_weather_etl_shard(cities, shard_id, run_id=None):
+
+    config = cargar_configuracion()
+    load_settings = dict(config.get('load_settings', {}), bulk_upsert=True, raise_on_failure=True)
+    load_settings.setdefault('use_copy', False)
+    config['load_settings'] = load_settings
+
+    return run_weather_etl_ciudades(cities, config, run_id=f"{run_id}_shard{shard_id}")
+
+# Función para combinar los resultados de los shards (listas de registros o rutas a artefactos)
+
+def combinar_resultados_shards(resultados):
+    combinado = []
+    for resultado in resultados:
+        if isinstance(resultado, str):
+            combinado.append(resultado)
+        elif resultado:
+            combinado.extend(resultado)
+    return combinado
+
+# Función que descarga, limpia y carga en Redshift los datos de una lista de ciudades
+
+def run_weather_etl_ciudades(locations, config, run_id=None):
+
+    # Con stream_settings.enabled cada ciudad se procesa a medida que llega
+    if config.get('stream_settings', {}).get('enabled', False):
+        return run_weather_etl_streaming(locations, config, run_id=run_id)
 
     # Lista para almacenar los DataFrames individuales de cada ubicación
     all_weather_data = []
 
+    # Configuración opcional de descarga concurrente (editable desde config_alertas.json)
+    fetch_settings = config.get('fetch_settings', {})
+
+    # Cache opcional de respuestas de la API (editable desde config_alertas.json)
+    cache = crear_cache_pronosticos(config.get('cache_settings', {}))
+
+    # Plazo total de la descarga (sin límite salvo que se configure fetch_settings.deadline) y
+    # parámetros del circuit breaker (editables desde config_alertas.json)
+    plazo = Plazo(fetch_settings.get('deadline'))
+    resiliencia = config.get('resilience_settings', {})
+
     # Se obtiene los datos meteorológicos para cada ubicación y se agrega a un DataFrame general
-    for location in locations:
-        weather_df = get_weather_data(location['lon'], location['lat'], location['name'])
-        all_weather_data.append(weather_df)
+    with medir('descarga_ciudades'):
+        if fetch_settings.get('concurrent', False):
+            all_weather_data = get_weather_data_concurrente(
+                locations,
+                max_concurrencia=fetch_settings.get('max_concurrency', 8),
+                timeout=fetch_settings.get('timeout', TIMEOUT_7TIMER),
+                cache=cache,
+                plazo=plazo,
+                resiliencia=resiliencia,
+            )
+        else:
+            with descargador_ciudades(1, fetch_settings.get('timeout', TIMEOUT_7TIMER), cache, plazo, resiliencia) as tomar_ciudad:
+                for location in locations:
+                    weather_df = tomar_ciudad(location)
+                    all_weather_data.append(weather_df)
+    incrementar('ciudades', len(locations))
+
+    if cache is not None:
+        cache.registrar_estadisticas()
 
     # Se combina todos los DataFrames en uno solo
     combined_weather_df = pd.concat(all_weather_data)
@@ -193,20 +663,89 @@ def run_weather_etl():
     # Validación de nulos y valores atípicos
     combined_weather_df.dropna(inplace=True)
 
-    # Se conecta y carga datos en Redshift
-    conn = conectar_redshift()
+    # Configuración opcional de carga masiva con upsert (editable desde config_alertas.json)
+    load_settings = config.get('load_settings', {})
+
+    # Se toma una conexión del pool y se cargan los datos en Redshift
+    with conexion_redshift(config.get('pool_settings')) as conn:
+        if conn:
+            cargar_datos_warehouse(conn, combined_weather_df, load_settings)
+        else:
+            sin_conexion_warehouse(load_settings)
+
+    # Solo 3 columnas a analizar en las siguientes tareas
+    # (más las métricas con reglas de alerta definidas en metric_limits)
+    alert_columns = ['city_name', 'timestamp', 'temp2m']
+    alert_columns += [m for m in config.get('metric_limits', {}) if m in combined_weather_df.columns and m not in alert_columns]
 
-    if conn:
-        cargar_en_redshift(conn=conn, tabla='tabla_temperatura', dataframe=combined_weather_df)
-        conn.close()
+    # Con xcom_settings.mode = 'artifact' se guarda un archivo columnar y por XCom viaja solo su ruta
+    xcom_settings = config.get('xcom_settings', {})
+    if xcom_settings.get('mode') == 'artifact':
+        return guardar_artefacto(combined_weather_df[alert_columns], xcom_settings, run_id=run_id)
 
     # Se convierte Timestamp a string después de la carga en Redshift para utilizar en xCom
     combined_weather_df['timestamp'] = combined_weather_df['timestamp'].astype(str)
 
-    # Se convierte el dataframe en diccionario y con solo 3 columnas a analizar en las siguientes tareas
-    combined_weather_df=combined_weather_df[['city_name', 'timestamp', 'temp2m']].to_dict(orient='records')
+    # Se convierte el dataframe en diccionario
+    combined_weather_df=combined_weather_df[alert_columns].to_dict(orient='records')
 
     return combined_weather_df
 
+# Función que procesa las ciudades en streaming: cada pronóstico se descarga, se limpia, se
+# acumula hasta completar un bloque de stream_settings.chunk_rows filas, se carga en Redshift
+# y del bloque solo se conservan las filas candidatas a alerta. La memoria máxima depende del
+# tamaño del bloque y de la concurrencia, no de la cantidad de ciudades
+
+def run_weather_etl_streaming(locations, config, run_id=None):
+
+    fetch_settings = config.get('fetch_settings', {})
+    stream_settings = config.get('stream_settings', {})
+    load_settings = config.get('load_settings', {})
+    temp_limits = config['temperature_limits']
+    metric_limits = config.get('metric_limits', {})
+
+    cache = crear_cache_pronosticos(config.get('cache_settings', {}))
+    max_concurrencia = fetch_settings.get('max_concurrency', 8) if fetch_settings.get('concurrent', False) else 1
+
+    pronosticos = iterar_pronosticos(
+        locations,
+        max_concurrencia=max_concurrencia,
+        timeout=fetch_settings.get('timeout', TIMEOUT_7TIMER),
+        cache=cache,
+        plazo=Plazo(fetch_settings.get('deadline')),
+        resiliencia=config.get('resilience_settings', {}),
+    )
+    # Validación de nulos por ciudad, antes de acumular el bloque
+    limpios = (df.dropna() for df in pronosticos)
+
+    candidatos = []
+    alert_columns = None
+    with conexion_redshift(config.get('pool_settings')) as conn:
+        if not conn:
+            sin_conexion_warehouse(load_settings)
+        for bloque in agrupar_en_bloques(limpios, stream_settings.get('chunk_rows', 5000)):
+            incrementar('bloques_streaming')
+            if conn:
+                cargar_datos_warehouse(conn, bloque, load_settings)
+
+            if alert_columns is None:
+                alert_columns = ['city_name', 'timestamp', 'temp2m']
+                alert_columns += [m for m in metric_limits if m in bloque.columns and m not in alert_columns]
+            candidatos.append(bloque.loc[mascara_candidatos_alerta(bloque, temp_limits, metric_limits), alert_columns])
+
+    if cache is not None:
+        cache.registrar_estadisticas()
+
+    alert_columns = alert_columns or ['city_name', 'timestamp', 'temp2m']
+    resultado = pd.concat(candidatos, ignore_index=True) if candidatos else pd.DataFrame(columns=alert_columns)
+    logging.info("Streaming: %s ciudades, %s filas candidatas a alerta", len(locations), len(resultado))
+
+    xcom_settings = config.get('xcom_settings', {})
+    if xcom_settings.get('mode') == 'artifact':
+        return guardar_artefacto(resultado, xcom_settings, run_id=run_id)
+
+    resultado['timestamp'] = resultado['timestamp'].astype(str)
+    return resultado.to_dict(orient='records')
+
 if __name__ == "__main__":
     run_weather_etl()